@@ -0,0 +1,468 @@
+'''Seeded micro and macro benchmarks of models and rendering
+
+Prints JSON report with ops/sec, p50/p99 latency of one operation and
+peak of memory allocated by a sample (tracemalloc) for every benchmark.
+Usage:
+    python3 bench.py [-k NAME] [--quick] [--save FILE] [--baseline FILE]
+Report saved with --save can be given as --baseline of later runs,
+exit status is 1 if some benchmark is slower than baseline by more than
+--tolerance.
+'''
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import pygame
+
+import grid
+import snake_ai
+import snake_core
+import tetris_ai
+import tetris_core
+from observation import SnakeObservation, TetrisObservation
+from scheduler import VirtualClock
+
+BENCHMARKS = []
+
+
+def benchmark(name, samples=50, macro=False):
+    '''Registers benchmark: setup function taking seed and returning
+    callable which performs one operation'''
+    def register(setup):
+        BENCHMARKS.append((name, setup, samples, macro))
+        return setup
+    return register
+
+
+def _played_model(model_class, seed, turns=60):
+    '''Returns headless tetris model after seeded random play'''
+    engine = tetris_core.TetrisEngine(seed=seed, model_class=model_class)
+    rand = random.Random(seed)
+    for turn in range(turns):
+        if engine.done:
+            engine.reset(seed)
+        engine.step(rand.choice(engine.actions[:4]))
+    return engine.model
+
+
+def _o_piece():
+    '''Returns (piece_id, rotation) of square piece'''
+    for piece_id, rotations in enumerate(tetris_core._PIECES):
+        if rotations[0].bbox[2] - rotations[0].bbox[0] == 1 and \
+                rotations[0].bbox[3] - rotations[0].bbox[1] == 1:
+            return (piece_id, 0)
+
+
+for model_class in (tetris_core.TetrisModel, tetris_core.BitboardTetrisModel):
+    suffix = "" if model_class is tetris_core.TetrisModel else "[bitboard]"
+
+    @benchmark("tetris.collides" + suffix)
+    def bench_collides(seed, model_class=model_class):
+        model = _played_model(model_class, seed)
+        rand = random.Random(seed)
+        width, height = model.grid_size
+        probes = [(model.random_piece(),
+                   (rand.randrange(-1, width - 1), rand.randrange(height - 2)))
+                  for i in range(64)]
+
+        def op():
+            for piece, pos in probes:
+                model.collides(piece, pos)
+        op.batch = len(probes)
+        return op
+
+    @benchmark("tetris.make_next_step" + suffix)
+    def bench_make_next_step(seed, model_class=model_class):
+        model = _played_model(model_class, seed)
+
+        def op():
+            if not model.tick():
+                model.reinit_round()
+        return op
+
+    @benchmark("tetris.remove_full_lines" + suffix)
+    def bench_remove_full_lines(seed, model_class=model_class):
+        model = model_class(size=(10, 20), seed=seed, clock=VirtualClock())
+        piece = _o_piece()
+        width, height = model.grid_size
+        positions = [(x, y) for y in range(height - 4, height, 2)
+                     for x in range(0, width, 2)]
+        rows = range(height - 4, height)
+
+        def op():
+            # fills 4 bottom lines with squares and clears them
+            for pos in positions:
+                model.place_piece(piece, pos)
+            model.remove_full_lines(rows)
+        return op
+
+
+@benchmark("tetris.landing_row")
+def bench_landing_row(seed):
+    model = _played_model(tetris_core.TetrisModel, seed)
+
+    def op():
+        model.landing_row()
+    return op
+
+
+@benchmark("tetris_ai.best_placement", samples=20)
+def bench_best_placement(seed):
+    model = _played_model(tetris_core.BitboardTetrisModel, seed, turns=20)
+    planner = tetris_ai.Planner()
+
+    def op():
+        planner.cache.clear()
+        planner.best_placement(model)
+    return op
+
+
+@benchmark("snapshot[tetris]")
+def bench_tetris_snapshot(seed):
+    model = _played_model(tetris_core.BitboardTetrisModel, seed)
+    rand = random.Random(seed)
+
+    def op():
+        model.apply_action(rand.choice(tetris_core.TetrisEngine.actions[:4]))
+        if not model.tick():
+            model.reinit_round()
+        model.snapshot()
+    return op
+
+
+@benchmark("snapshot[snake]")
+def bench_snake_snapshot(seed):
+    step = _snake_on_cycle(100)
+
+    def op():
+        step()
+        step.model.snapshot()
+    return op
+
+
+@benchmark("snake_ai.next_action[100x100]")
+def bench_snake_pilot(seed):
+    engine = snake_core.SnakeEngine(size=(100, 100), seed=seed)
+    pilot = snake_ai.Pilot()
+
+    def op():
+        engine.step(pilot.next_action(engine.model))
+        if engine.done:
+            engine.reset(seed)
+    return op
+
+
+def _snake_on_cycle(length):
+    '''Returns SnakeModel of `length` moving around 2-row field
+    without collectibles, its length stays constant'''
+    width = length + 1
+    model = snake_core.SnakeModel(length=length, startpos=(length - 1, 0),
+                                  size=(width, 2), clock=VirtualClock(),
+                                  collectibles=0)
+
+    def step():
+        x, y = model.body_cells[0]
+        if y == 0:
+            model.set_direction((1, 0) if x < width - 1 else (0, 1))
+        else:
+            model.set_direction((-1, 0) if x > 0 else (0, -1))
+        model.make_next_step()
+    step.model = model
+    return step
+
+
+for length in (3, 100, 1000):
+    @benchmark("snake.make_next_step[length={}]".format(length))
+    def bench_snake_step(seed, length=length):
+        return _snake_on_cycle(length)
+
+
+@benchmark("snake.make_next_step[collectibles]")
+def bench_snake_collectibles(seed):
+    model = snake_core.SnakeModel(size=(40, 40), seed=seed,
+                                  clock=VirtualClock(), collectibles=50)
+    rand = random.Random(seed)
+
+    def op():
+        model.set_direction(rand.choice(snake_core.SnakeEngine.actions[1:]))
+        if not model.tick():
+            model.reinit_round()
+    return op
+
+
+@benchmark("observation.update[tetris]")
+def bench_tetris_observation(seed):
+    model = _played_model(tetris_core.BitboardTetrisModel, seed)
+    observation = TetrisObservation(model, frames=4)
+    rand = random.Random(seed)
+
+    def op():
+        model.apply_action(rand.choice(tetris_core.TetrisEngine.actions[:4]))
+        if not model.tick():
+            model.reinit_round()
+        observation.update()
+    return op
+
+
+@benchmark("observation.update[snake]")
+def bench_snake_observation(seed):
+    step = _snake_on_cycle(100)
+    observation = SnakeObservation(step.model, frames=4)
+
+    def op():
+        step()
+        observation.update()
+    return op
+
+
+def _grid_frame(size, backend, seed, changed=8):
+    '''Returns function drawing one frame of grid with `changed` random
+    cells set, None sets every cell'''
+    cell_size = max(2, 600 // max(size))
+    screen = pygame.Surface((size[0] * cell_size + 1,
+                             size[1] * cell_size + 1))
+    g = grid.Grid(size, cell_size, 1, backend=backend)
+    rand = random.Random(seed)
+    colors = ["#FF00FF", "#00FF00", "#C0A0C0", "#FF0000"]
+    if changed is None:
+        cells = [(x, y) for x in range(size[0]) for y in range(size[1])]
+        frames = [[(pos, rand.choice(colors)) for pos in cells]
+                  for f in range(4)]
+    else:
+        frames = [[((rand.randrange(size[0]), rand.randrange(size[1])),
+                    rand.choice(colors)) for i in range(changed)]
+                  for f in range(16)]
+    g.draw(screen)
+    state = {"frame": 0}
+
+    def op():
+        g.clear()
+        for pos, color in frames[state["frame"] % len(frames)]:
+            g.set_cell_state(pos, color)
+        state["frame"] += 1
+        g.draw(screen)
+    return op
+
+
+for size in ((10, 20), (40, 40), (100, 100)):
+    for backend in ("blit", "surfarray"):
+        if backend == "surfarray" and grid.numpy is None:
+            continue
+
+        @benchmark("grid.draw[{}x{},{}]".format(size[0], size[1], backend))
+        def bench_grid_draw(seed, size=size, backend=backend):
+            return _grid_frame(size, backend, seed)
+
+
+for backend in ("blit", "surfarray"):
+    if backend == "surfarray" and grid.numpy is None:
+        continue
+
+    @benchmark("grid.draw_all[100x100,{}]".format(backend), samples=20)
+    def bench_grid_draw_all(seed, backend=backend):
+        return _grid_frame((100, 100), backend, seed, changed=None)
+
+
+@benchmark("score.draw")
+def bench_score_draw(seed):
+    from game import Score
+    screen = pygame.Surface((400, 100))
+    score = Score((10, 10), 8, "monospace", 24, pygame.Color("#101010"))
+    state = {"frame": 0}
+
+    def op():
+        # score changes every 30 frames like in a played game
+        state["frame"] += 1
+        score.set(state["frame"] // 30 * 100)
+        score.draw(screen)
+    return op
+
+
+def _headless_game(engine_class, seed, max_steps):
+    rand = random.Random(seed)
+    state = {"seed": seed}
+
+    def op():
+        engine = engine_class(seed=state["seed"])
+        state["seed"] += 1
+        while not engine.done and engine.steps < max_steps:
+            engine.step(rand.choice(engine.actions))
+    return op
+
+
+@benchmark("tetris.game", samples=10, macro=True)
+def bench_tetris_game(seed):
+    return _headless_game(tetris_core.TetrisEngine, seed, 10000)
+
+
+@benchmark("snake.game", samples=10, macro=True)
+def bench_snake_game(seed):
+    return _headless_game(snake_core.SnakeEngine, seed, 10000)
+
+
+@benchmark("tetris.ai_game", samples=3, macro=True)
+def bench_tetris_ai_game(seed):
+    state = {"seed": seed}
+
+    def op():
+        # AI plays 100 pieces
+        engine = tetris_core.TetrisEngine(
+            seed=state["seed"], model_class=tetris_core.BitboardTetrisModel)
+        state["seed"] += 1
+        while not engine.done and engine.model.pieces < 100:
+            engine.step(tetris_ai.policy(engine))
+    return op
+
+
+@benchmark("tetris.frame", macro=True)
+def bench_tetris_frame(seed):
+    import tetris
+    screen = pygame.display.set_mode((650, 350))
+    game = tetris.TetrisGame(screen)
+    game.game = tetris_core.TetrisModel(game.grid, seed=seed,
+                                        clock=VirtualClock())
+    game.autoplayer = tetris_ai.AutoPlayer()
+    clock = game.game.scheduler.clock
+
+    def op():
+        # one 60 fps frame of autoplayed game
+        clock.advance(1 / 60)
+        game.update()
+        game.draw()
+    return op
+
+
+@benchmark("multiboard.frame[tetris x16]", macro=True)
+def bench_multiboard_frame(seed):
+    import multiboard
+    screen = pygame.Surface((1280, 720))
+    clock = VirtualClock()
+    multi = multiboard.MultiBoard("tetris", 16, screen.get_size(),
+                                  policy=tetris_core.random_policy,
+                                  seed=seed, clock=clock)
+
+    def op():
+        # one 60 fps frame of 16 boards making turns every 0.05 s
+        clock.advance(1 / 60)
+        multi.update()
+        multi.draw(screen)
+    return op
+
+
+def _timed(op, number):
+    start = time.perf_counter()
+    for i in range(number):
+        op()
+    return time.perf_counter() - start
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def measure(op, samples, min_sample_time=0.002):
+    '''Runs op in `samples` samples of equal number of calls,
+    returns dict of results'''
+    batch = getattr(op, "batch", 1)
+    number = 1
+    while _timed(op, number) < min_sample_time and number < 1 << 20:
+        number *= 2
+    times = [_timed(op, number) / (number * batch) for i in range(samples)]
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    base = tracemalloc.get_traced_memory()[0]
+    _timed(op, number)
+    alloc_peak = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    return {
+        "ops_per_sec": round(samples / sum(times), 1),
+        "p50_us": round(_percentile(times, 0.5) * 1e6, 3),
+        "p99_us": round(_percentile(times, 0.99) * 1e6, 3),
+        "alloc_peak_bytes": alloc_peak,
+        "calls_per_sample": number * batch,
+        "samples": samples,
+    }
+
+
+def run(pattern=None, seed=0, quick=False):
+    '''Runs benchmarks with `pattern` in name, returns report dict'''
+    pygame.init()
+    results = {}
+    for name, setup, samples, macro in BENCHMARKS:
+        if pattern and pattern not in name:
+            continue
+        random.seed(seed)
+        op = setup(seed)
+        op()
+        if quick:
+            samples = max(3, samples // 5)
+        results[name] = measure(op, samples)
+        results[name]["macro"] = macro
+        print("{:45} {:>14.1f} ops/s".format(
+            name, results[name]["ops_per_sec"]), file=sys.stderr)
+    return {
+        "meta": {"python": platform.python_version(),
+                 "pygame": pygame.version.ver,
+                 "platform": platform.platform(),
+                 "seed": seed, "quick": quick},
+        "results": results,
+    }
+
+
+def compare(report, baseline, tolerance):
+    '''Prints comparison with baseline report,
+    returns list of names of regressed benchmarks'''
+    regressed = []
+    for name, result in report["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            continue
+        ratio = result["ops_per_sec"] / base["ops_per_sec"]
+        mark = ""
+        if ratio < 1 - tolerance:
+            regressed.append(name)
+            mark = "REGRESSION"
+        print("{:45} {:>7.2f}x {}".format(name, ratio, mark),
+              file=sys.stderr)
+    return regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="bench.py", description="Benchmark models and rendering")
+    parser.add_argument("-k", dest="pattern",
+                        help="run benchmarks with PATTERN in name")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--quick", action="store_true",
+                        help="take fewer samples")
+    parser.add_argument("--save", metavar="FILE",
+                        help="save report as JSON file")
+    parser.add_argument("--baseline", metavar="FILE",
+                        help="compare with report saved by --save")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed slowdown against baseline "
+                        "(default 0.2)")
+    args = parser.parse_args(argv)
+    report = run(args.pattern, args.seed, args.quick)
+    print(json.dumps(report, indent=2))
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
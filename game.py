@@ -1,23 +1,163 @@
+from collections import OrderedDict
+
 import pygame
 from pygame.locals import *
 
 
-class Score:
-    def __init__(self, pos, length, fontface, fontsize, fontcolor):
-        '''pos: top left coordinate of score box
-        lenght: number of digits in score indicator'''
+class GlyphAtlas:
+    '''Cache of text rendered with one font and color
+    self.glyphs: dict mapping characters to (surface, advance)
+    self.texts: LRU OrderedDict mapping whole strings to surfaces
+    '''
+    text_cache_size = 64
+
+    def __init__(self, fontface, fontsize, fontcolor):
+        self.font = pygame.font.SysFont(fontface, fontsize)
+        self.fontcolor = fontcolor
+        self.linesize = self.font.get_linesize()
+        self.glyphs = {}
+        self.texts = OrderedDict()
+
+    def glyph(self, char):
+        '''Returns (surface, advance) of single character'''
+        glyph = self.glyphs.get(char)
+        if glyph is None:
+            surf = self.font.render(char, 1, self.fontcolor)
+            metrics = self.font.metrics(char)[0]
+            advance = metrics[4] if metrics else surf.get_width()
+            glyph = self.glyphs[char] = (surf, advance)
+        return glyph
+
+    def text(self, text):
+        '''Returns surface of whole string, rendered on first request'''
+        surf = self.texts.get(text)
+        if surf is None:
+            surf = self.texts[text] = self.font.render(text, 1,
+                                                       self.fontcolor)
+            if len(self.texts) > self.text_cache_size:
+                self.texts.popitem(last=False)
+        else:
+            self.texts.move_to_end(text)
+        return surf
+
+    def layout(self, text, x=0):
+        '''Returns list of (surface, x) of glyphs composing text'''
+        result = []
+        for char in text:
+            surf, advance = self.glyph(char)
+            result.append((surf, x))
+            x += advance
+        return result
+
+    def compose(self, layout):
+        '''Blits glyph layout to new surface, returns it'''
+        width = max([x + surf.get_width() for surf, x in layout] or [0])
+        line = pygame.Surface((width, self.linesize), SRCALPHA)
+        # transparent font color keeps colors of blended glyph edges
+        line.fill(tuple(Color(self.fontcolor))[:3] + (0,))
+        for surf, x in layout:
+            line.blit(surf, (x, 0))
+        return line
+
+
+_atlases = {}
+
+
+def get_atlas(fontface, fontsize, fontcolor):
+    '''Returns GlyphAtlas shared by all text of the font and color'''
+    key = (fontface, fontsize, tuple(Color(fontcolor)))
+    atlas = _atlases.get(key)
+    if atlas is None:
+        atlas = _atlases[key] = GlyphAtlas(fontface, fontsize, fontcolor)
+    return atlas
+
+
+class TextBox:
+    '''Lines of text drawn on screen from cached glyphs,
+    subclasses give text_lines() and call invalidate() when text changes
+    self.surfaces: surfaces of lines composed from glyphs, None if text
+        has changed since the last draw()'''
+
+    def __init__(self, pos, fontface, fontsize, fontcolor):
+        '''pos: top left coordinate of text box'''
         self.pos = pos
-        self.length = length
         self.fontface = fontface
         self.fontsize = fontsize
         self.fontcolor = fontcolor
-        self.font = pygame.font.SysFont(fontface, fontsize)
+        self.atlas = get_atlas(fontface, fontsize, fontcolor)
+        self.surfaces = None
+
+    def text_lines(self):
+        return []
+
+    def layout_lines(self):
+        '''Returns list of glyph layouts of lines'''
+        return [self.atlas.layout(line) for line in self.text_lines()]
+
+    def invalidate(self):
+        '''Makes the next draw() compose text again'''
+        self.surfaces = None
+
+    def draw(self, screen):
+        '''Draws text on screen, returns rectangle of drawn area'''
+        if self.surfaces is None:
+            self.surfaces = [self.atlas.compose(layout)
+                             for layout in self.layout_lines()]
+        x, y = self.pos
+        rect = pygame.Rect(self.pos, (0, 0))
+        for surf in self.surfaces:
+            rect.union_ip(screen.blit(surf, (x, y)))
+            y += self.atlas.linesize
+        return rect
+
+
+class Score(TextBox):
+    label = "Score: "
+
+    def __init__(self, pos, length, fontface, fontsize, fontcolor):
+        '''pos: top left coordinate of score box
+        lenght: number of digits in score indicator'''
+        TextBox.__init__(self, pos, fontface, fontsize, fontcolor)
+        self.length = length
         self.val = 0
 
     def set(self, val):
-        self.val = val
+        if val != self.val:
+            self.val = val
+            self.invalidate()
+
+    def text_lines(self):
+        return [self.label + str(self.val).zfill(self.length)]
+
+    def layout_lines(self):
+        label = self.atlas.text(self.label)
+        return [[(label, 0)] + self.atlas.layout(
+            str(self.val).zfill(self.length), label.get_width())]
+
+
+class ProfilerHud(TextBox):
+    '''Overlay showing statistics of profiler.FrameProfiler,
+    text is laid out again every self.refresh_frames frames'''
+    refresh_frames = 15
+
+    def __init__(self, pos, fontface, fontsize, fontcolor, profiler):
+        TextBox.__init__(self, pos, fontface, fontsize, fontcolor)
+        self.profiler = profiler
+        self.layout_frame = None
+
+    def text_lines(self):
+        profiler = self.profiler
+        lines = ["FPS {:5.1f} worst {:5.1f}ms".format(
+                     profiler.fps(), profiler.worst_frame() * 1000),
+                 "dropped ticks {}".format(profiler.dropped)]
+        for name, seconds in profiler.phase_means().items():
+            lines.append("{:11}{:6.2f}ms".format(name, seconds * 1000))
+        return lines
 
     def draw(self, screen):
-        score_surf = self.font.render(
-            "Score: " + str(self.val).zfill(self.length), 1, self.fontcolor)
-        screen.blit(score_surf, self.pos)
+        if self.layout_frame is None or \
+                self.profiler.count - self.layout_frame >= \
+                self.refresh_frames:
+            self.invalidate()
+            self.layout_frame = self.profiler.count
+        return TextBox.draw(self, screen)
@@ -1,6 +1,13 @@
+from collections import OrderedDict
+
 import pygame
 from pygame.locals import *
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 class Grid:
     '''Grid object, representing colored grid
@@ -9,28 +16,70 @@ class Grid:
     empty_color = "#FFFFFF"
     border_color = "#404040"
     active_color = "#FF00FF"
+    max_colors = 255
+    surface_cache_size = 16
 
-    def __init__(self, size, cell_size=10, cell_border=1, topleft=(0, 0)):
+    def __init__(self, size, cell_size=10, cell_border=1, topleft=(0, 0),
+                 backend="blit", image=None):
         '''size: (width , height) dimensions of grid in cellsi
         cell_size: size of side of cell
         cell_border: border size of outline of cells
                      including grid's outer borderi
         topleft: (x,y) coordinates of top left corner
+        backend: "blit" redraws changed cells one by one,
+                 "surfarray" keeps self.cell_data in numpy array and
+                 rasterizes box of changed cells at once (requires numpy)
+        image: Surface of grid size to draw on instead of own self.image,
+               e.g. subsurface of atlas shared by many grids
         self.image: Surface-object containing visual representation of grid
                 after calling an self.update() method
         self.rect: rectangular, containing Grid
 
-        self.cell_data: 2d-array with self.size dimensions containing
-                        colors of Grid's cells in "#XXXXXX" format
+        self.palette: list of colors in "#XXXXXX" format used on Grid,
+                      index 0 is reserved for empty cell (None)
+
+        self.cell_data: array of bytearrays (numpy array for "surfarray"
+                        backend) with self.size dimensions containing
+                        self.palette indices of Grid's cells
+
+        self._palette_index: dict mapping colors to self.palette indices
 
-        self._cell_surfaces: 2d-array with self.size dimension containing
-                             colored surfaces of corresponding colors
+        self._palette_colors: list of Color objects of self.palette
+
+        self._surface_cache: OrderedDict mapping self.palette indices
+                             to filled cell surfaces, least recently used
+                             surfaces are evicted past self.surface_cache_size
 
         self._cell_rects: 2d-array with self.size dimensions containing
                           rectangles of cells (in self.image coordinates)
 
+        self._drawn_data: array of bytearrays with self.size dimensions
+                          containing self.palette indices of cells as they
+                          are drawn on self.image, self.max_colors for
+                          not drawn cells
+
+        self._dirty: set of cells changed since last self.update()
+
+        self._shown: set of non-empty cells drawn on self.image
+
+        self._palette_pixels: ("surfarray" backend) array of colors of
+                              self.palette mapped to pixels of self.image,
+                              last entry is border color
 
+        self._index_map: ("surfarray" backend) array with 2 * self.size + 1
+                         dimensions, cells are at odd coordinates and
+                         borders between them at even ones,
+                         self.cell_data is a view of it
+
+        self._repeat_x, self._repeat_y: ("surfarray" backend) arrays of
+                                        widths in pixels of columns and
+                                        rows of self._index_map
         '''
+        if backend not in ("blit", "surfarray"):
+            raise ValueError("Unknown Grid backend: " + str(backend))
+        if backend == "surfarray" and numpy is None:
+            raise ImportError("surfarray Grid backend requires numpy")
+        self.backend = backend
         self.size = size
         self.cell_size = cell_size
         self.cell_border = cell_border
@@ -38,35 +87,147 @@ class Grid:
             self.cell_border
         surface_height = self.size[1] * (self.cell_size + self.cell_border) + \
             self.cell_border
-        self.image = pygame.Surface((surface_width, surface_height))
+        if image is None:
+            image = pygame.Surface((surface_width, surface_height))
+        elif image.get_size() != (surface_width, surface_height):
+            raise ValueError("Grid image should have size " +
+                             str((surface_width, surface_height)))
+        self.image = image
         self.image.fill(Color(self.border_color))
         self.rect = self.image.get_rect()
         self.rect.topleft = topleft
-        self.cell_data = [
-            [None for y in range(size[1])] for x in range(size[0])]
-        self._cell_surfaces = [[pygame.Surface((self.cell_size, self.cell_size))
-                                for y in range(size[1])] for x in range(size[0])]
+        self.palette = [None]
+        self._palette_index = {None: 0}
+        self._palette_colors = [Color(self.empty_color)]
+        self._surface_cache = OrderedDict()
+        if self.backend == "surfarray":
+            self._init_cell_array()
+        else:
+            self.cell_data = [bytearray(size[1]) for x in range(size[0])]
         self._cell_rects = [[self._cell_coord_to_rect(x, y) for y in range(size[1])]
                             for x in range(size[0])]
+        self._shown = set()
+        self.invalidate()
         self.update()
 
+    def _init_cell_array(self):
+        '''Prepares numpy arrays used by "surfarray" backend'''
+        self._palette_pixels = numpy.zeros(self.max_colors + 1, numpy.uint32)
+        self._palette_pixels[0] = self.image.map_rgb(self._palette_colors[0])
+        self._palette_pixels[self.max_colors] = self.image.map_rgb(
+            Color(self.border_color))
+        self._index_map = numpy.full(
+            (2 * self.size[0] + 1, 2 * self.size[1] + 1), self.max_colors,
+            numpy.uint8)
+        self.cell_data = self._index_map[1::2, 1::2]
+        self.cell_data[:] = 0
+
+        def repeats(cells):
+            '''Returns widths of borders and cells along one axis'''
+            widths = numpy.full(2 * cells + 1, self.cell_border, numpy.intp)
+            widths[1::2] = self.cell_size
+            return widths
+
+        self._repeat_x = repeats(self.size[0])
+        self._repeat_y = repeats(self.size[1])
+
     def _cell_coord_to_rect(self, n, m):
         '''Converts (column,row) coordinates of cell to Rect'''
         return Rect((self.cell_border * (n + 1) + self.cell_size * n,
                      self.cell_border * (m + 1) + self.cell_size * m),
                     (self.cell_size, self.cell_size))
 
+    def _color_index(self, color_str):
+        '''Returns self.palette index of color, adds it if not present'''
+        index = self._palette_index.get(color_str)
+        if index is None:
+            index = len(self.palette)
+            if index >= self.max_colors:
+                raise ValueError("Grid palette is full")
+            self.palette.append(color_str)
+            self._palette_colors.append(Color(color_str))
+            self._palette_index[color_str] = index
+            if self.backend == "surfarray":
+                self._palette_pixels[index] = self.image.map_rgb(
+                    self._palette_colors[index])
+        return index
+
+    def _color_surface(self, index):
+        '''Returns cell surface filled with color of palette index'''
+        surface = self._surface_cache.get(index)
+        if surface is None:
+            surface = pygame.Surface((self.cell_size, self.cell_size))
+            surface.fill(self._palette_colors[index])
+            self._surface_cache[index] = surface
+            if len(self._surface_cache) > self.surface_cache_size:
+                self._surface_cache.popitem(last=False)
+        else:
+            self._surface_cache.move_to_end(index)
+        return surface
+
     def _draw_cell_surfaces(self):
-        for x in range(self.size[0]):
-            for y in range(self.size[1]):
-                color = self.cell_data[x][y] if self.cell_data[x][y] else self.empty_color
-                self._cell_surfaces[x][y].fill(Color(color))
-                self.image.blit(
-                    self._cell_surfaces[x][y], self._cell_rects[x][y])
+        '''Redraws cells which color differs from the drawn one,
+        returns list of their rectangles (in self.image coordinates)'''
+        rects = []
+        for x, y in self._dirty:
+            index = self.cell_data[x][y]
+            if index == self._drawn_data[x][y]:
+                continue
+            self.image.blit(
+                self._color_surface(index), self._cell_rects[x][y])
+            self._drawn_data[x][y] = index
+            if index:
+                self._shown.add((x, y))
+            else:
+                self._shown.discard((x, y))
+            rects.append(self._cell_rects[x][y])
+        self._dirty.clear()
+        return rects
+
+    def _draw_cell_array(self):
+        '''Rasterizes bounding box of changed cells of self.cell_data
+        in one step, colors of cells and borders are repeated to pixels,
+        returns list with rectangle of the box (in self.image coordinates)
+        or empty list if no cell changed'''
+        self._dirty.clear()
+        changed = self.cell_data != self._drawn_data
+        xs = numpy.flatnonzero(changed.any(axis=1))
+        if not len(xs):
+            return []
+        ys = numpy.flatnonzero(changed.any(axis=0))
+        x0, x1 = int(xs[0]), int(xs[-1]) + 1
+        y0, y1 = int(ys[0]), int(ys[-1]) + 1
+        columns = slice(2 * x0, 2 * x1 + 1)
+        rows = slice(2 * y0, 2 * y1 + 1)
+        pixels = self._palette_pixels[self._index_map[columns, rows]]
+        pixels = pixels.repeat(self._repeat_x[columns], axis=0) \
+            .repeat(self._repeat_y[rows], axis=1)
+        step = self.cell_size + self.cell_border
+        rect = Rect((x0 * step, y0 * step), pixels.shape)
+        pygame.surfarray.blit_array(self.image.subsurface(rect), pixels)
+        self._drawn_data[x0:x1, y0:y1] = self.cell_data[x0:x1, y0:y1]
+        return [rect]
+
+    def invalidate(self):
+        '''Forces redraw of every cell and full blit on next self.draw(),
+        should be called when screen under the grid was overdrawn'''
+        self._full_blit = True
+        if self.backend == "surfarray":
+            self._drawn_data = numpy.full(
+                self.size, self.max_colors, numpy.uint8)
+            self._dirty = set()
+            return
+        self._drawn_data = [bytearray([self.max_colors]) * self.size[1]
+                            for x in range(self.size[0])]
+        self._dirty = set((x, y) for x in range(self.size[0])
+                          for y in range(self.size[1]))
 
     def update(self):
-        '''Redraw self.image'''
-        self._draw_cell_surfaces()
+        '''Redraw changed cells of self.image,
+        returns list of redrawn rectangles (in self.image coordinates)'''
+        if self.backend == "surfarray":
+            return self._draw_cell_array()
+        return self._draw_cell_surfaces()
 
     def abs_coord_to_cell(self, pos):
         '''Takes absolute display coordinates and
@@ -88,11 +249,12 @@ class Grid:
         pos: 2-tuple (c,r)
         color_str: color in #XXXXXX format'''
         x, y = pos
-        self.cell_data[x][y] = color_str
+        self.cell_data[x][y] = self._color_index(color_str)
+        self._dirty.add(pos)
 
     def get_cell_state(self, pos):
         x, y = pos
-        return self.cell_data[x][y]
+        return self.palette[self.cell_data[x][y]]
 
     def get_size(self):
         return self.size
@@ -101,20 +263,188 @@ class Grid:
         '''Flips color in cell with pos (colomun,row) coordinates'''
         x, y = pos
         if(self.cell_data[x][y]):
-            self.cell_data[x][y] = None
+            self.cell_data[x][y] = 0
         else:
-            self.cell_data[x][y] = self.active_color
+            self.cell_data[x][y] = self._color_index(self.active_color)
+        self._dirty.add((x, y))
 
     def clear(self):
-        '''Clears self.cell_data inplace'''
-        for x in range(self.size[0]):
-            for y in range(self.size[1]):
-                self.cell_data[x][y] = None
+        '''Clears self.cell_data inplace,
+        touches only cells which were set or drawn non-empty'''
+        if self.backend == "surfarray":
+            self.cell_data[:] = 0
+            return
+        self._dirty.update(self._shown)
+        for x, y in self._dirty:
+            self.cell_data[x][y] = 0
 
     def draw(self, screen):
-        '''Draws grid on screen'''
-        self.update()
-        screen.blit(self.image, self.rect)
+        '''Draws changed cells of grid on screen,
+        returns list of changed rectangles (in screen coordinates)'''
+        rects = self.update()
+        if self._full_blit:
+            self._full_blit = False
+            return [screen.blit(self.image, self.rect)]
+        return [screen.blit(self.image, rect.move(self.rect.topleft), rect)
+                for rect in rects]
+
+
+class ChunkedGrid:
+    '''Grid of huge size storing only non-empty chunks of cells and
+    drawing only cells inside of scrolling viewport, has interface of Grid
+    self.size: (width, height) of the whole grid in cells
+    self.view: Grid of viewport size drawing visible cells
+    self.offset: (column, row) of the top left visible cell
+    self.chunks: dict mapping (column, row) of chunk to bytearray of
+                 self.palette indices of its cells, only chunks with
+                 non-empty cells are stored
+    self._chunk_counts: dict mapping chunks to numbers of non-empty cells
+    '''
+    chunk_size = 16
+
+    def __init__(self, size, view_size=(40, 30), cell_size=10,
+                 cell_border=1, topleft=(0, 0), backend="blit"):
+        '''size: (width, height) dimensions of grid in cells
+        view_size: (width, height) dimensions of viewport in cells,
+                   other arguments are passed to viewport Grid'''
+        self.size = size
+        view_size = (min(view_size[0], size[0]), min(view_size[1], size[1]))
+        self.view = Grid(view_size, cell_size, cell_border, topleft, backend)
+        self.cell_size = cell_size
+        self.cell_border = cell_border
+        self.image = self.view.image
+        self.rect = self.view.rect
+        self.palette = self.view.palette
+        self.offset = (0, 0)
+        self.chunks = {}
+        self._chunk_counts = {}
+
+    def _store(self, x, y, index):
+        '''Stores palette index of cell, drops chunk becoming empty'''
+        chunk_size = self.chunk_size
+        key = (x // chunk_size, y // chunk_size)
+        chunk = self.chunks.get(key)
+        if chunk is None:
+            if not index:
+                return
+            chunk = self.chunks[key] = bytearray(chunk_size * chunk_size)
+            self._chunk_counts[key] = 0
+        i = y % chunk_size * chunk_size + x % chunk_size
+        if chunk[i] and not index:
+            self._chunk_counts[key] -= 1
+            if not self._chunk_counts[key]:
+                del self.chunks[key]
+                del self._chunk_counts[key]
+                return
+        elif index and not chunk[i]:
+            self._chunk_counts[key] += 1
+        chunk[i] = index
+
+    def _index(self, x, y):
+        chunk = self.chunks.get((x // self.chunk_size, y // self.chunk_size))
+        if chunk is None:
+            return 0
+        return chunk[y % self.chunk_size * self.chunk_size +
+                     x % self.chunk_size]
+
+    def set_cell_state(self, pos, color_str):
+        '''Sets color of the cell with `pos` coordinated
+        pos: 2-tuple (c,r)
+        color_str: color in #XXXXXX format'''
+        x, y = pos
+        self._store(x, y, self.view._color_index(color_str))
+        x -= self.offset[0]
+        y -= self.offset[1]
+        if 0 <= x < self.view.size[0] and 0 <= y < self.view.size[1]:
+            self.view.set_cell_state((x, y), color_str)
+
+    def get_cell_state(self, pos):
+        return self.palette[self._index(pos[0], pos[1])]
+
+    def get_size(self):
+        return self.size
+
+    def flip_color(self, pos):
+        '''Flips color in cell with pos (colomun,row) coordinates'''
+        if self._index(pos[0], pos[1]):
+            self.set_cell_state(pos, None)
+        else:
+            self.set_cell_state(pos, self.view.active_color)
+
+    def clear(self):
+        '''Removes all chunks and clears viewport'''
+        self.chunks = {}
+        self._chunk_counts = {}
+        self.view.clear()
+
+    def scroll_to(self, offset):
+        '''Moves viewport to show cells from `offset` (column, row),
+        viewport is kept inside of the grid'''
+        offset = (max(0, min(offset[0], self.size[0] - self.view.size[0])),
+                  max(0, min(offset[1], self.size[1] - self.view.size[1])))
+        if offset == self.offset:
+            return
+        self.offset = offset
+        self.view.clear()
+        self._copy_visible()
+
+    def follow(self, pos, margin=None):
+        '''Scrolls viewport to center `pos` when it comes closer than
+        `margin` cells (quarter of viewport by default) to viewport edge'''
+        view_w, view_h = self.view.size
+        if margin is None:
+            margin = (view_w // 4, view_h // 4)
+        x = pos[0] - self.offset[0]
+        y = pos[1] - self.offset[1]
+        if not (margin[0] <= x < view_w - margin[0] and
+                margin[1] <= y < view_h - margin[1]):
+            self.scroll_to((pos[0] - view_w // 2, pos[1] - view_h // 2))
+
+    def _copy_visible(self):
+        '''Copies cells of chunks intersecting viewport to it'''
+        chunk_size = self.chunk_size
+        left, top = self.offset
+        right = left + self.view.size[0]
+        bottom = top + self.view.size[1]
+        for cy in range(top // chunk_size, (bottom - 1) // chunk_size + 1):
+            for cx in range(left // chunk_size,
+                            (right - 1) // chunk_size + 1):
+                chunk = self.chunks.get((cx, cy))
+                if chunk is None:
+                    continue
+                for i, index in enumerate(chunk):
+                    if not index:
+                        continue
+                    x = cx * chunk_size + i % chunk_size
+                    y = cy * chunk_size + i // chunk_size
+                    if left <= x < right and top <= y < bottom:
+                        self.view.set_cell_state((x - left, y - top),
+                                                 self.palette[index])
+
+    def invalidate(self):
+        self.view.invalidate()
+
+    def update(self):
+        '''Redraw changed visible cells,
+        returns list of redrawn rectangles (in self.image coordinates)'''
+        return self.view.update()
+
+    def draw(self, screen):
+        '''Draws changed visible cells on screen,
+        returns list of changed rectangles (in screen coordinates)'''
+        return self.view.draw(screen)
+
+    def abs_coord_to_cell(self, pos):
+        '''Takes absolute display coordinates and
+        gives cell(column,row) of the whole grid containing them'''
+        cell = self.view.abs_coord_to_cell(pos)
+        if cell is None:
+            return None
+        x = cell[0] + self.offset[0]
+        y = cell[1] + self.offset[1]
+        if x < self.size[0] and y < self.size[1]:
+            return (x, y)
+        return None
 
 
 def main():
@@ -127,9 +457,7 @@ def main():
     background.fill(Color("#808080"))
     screen.blit(background, background.get_rect())
     grid = Grid((20, 20), 10, 1, (20, 10))
-    grid.cell_data[0][0] = grid.active_color
-
-    screen.blit(grid.image, grid.rect)
+    grid.set_cell_state((0, 0), grid.active_color)
     pygame.display.flip()
 
     clock = pygame.time.Clock()
@@ -144,8 +472,7 @@ def main():
                 pos = grid.abs_coord_to_cell(pygame.mouse.get_pos())
                 if pos:
                     grid.flip_color(pos)
-        grid.draw(screen)
-        pygame.display.flip()
+        pygame.display.update(grid.draw(screen))
 
 
 if __name__ == "__main__":
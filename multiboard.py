@@ -0,0 +1,220 @@
+'''Many tetris or snake boards played by bots or replays in one window
+
+Grids of all boards draw on subsurfaces of one atlas surface, only boards
+which made a turn are redrawn and only their changed cells are copied to
+the screen. All boards make turns from one FixedTimestep.
+Usage:
+    python3 tetris.py multi [-n COUNT] [--policy module:name]
+    python3 snake.py multi --replay ARCHIVE
+'''
+import argparse
+import math
+import time
+
+import pygame
+from pygame.locals import *
+
+import tournament
+from game import Score
+from grid import Grid
+from replay import ReplayArchive, ReplayFeed
+from scheduler import FixedTimestep
+
+DEFAULT_POLICIES = {
+    "tetris": "tetris_ai:policy",
+    "snake": "snake_ai:policy",
+}
+
+
+class Board:
+    '''One game of multi-board screen
+    self.engine: TetrisEngine or SnakeEngine, its model draws on self.grid
+    self.policy: function of engine returning action (bot board)
+    self.replay: replay.Replay played in a loop (replay board), all its
+        rounds are played before it starts again
+    self.changed: True if the board made a turn since the last draw
+    '''
+
+    def __init__(self, kind, grid, seed=None, policy=None, replay=None):
+        self.kind = kind
+        self.grid = grid
+        self.seed = seed
+        self.policy = policy
+        self.replay = replay
+        self.score = None
+        self.score_rect = None
+        self.restart()
+
+    def restart(self):
+        '''Starts new round, replay board starts its replay again'''
+        if self.replay is not None:
+            self.seed = self.replay.seed
+            self.feed = ReplayFeed(self.replay)
+        elif self.seed is not None:
+            self.seed += 1
+        self.engine = tournament.ENGINES[self.kind](size=self.grid.size,
+                                                    seed=self.seed)
+        self.engine.model.grid = self.grid
+        self.changed = True
+
+    def tick(self):
+        '''Makes one turn of the game'''
+        if self.replay is not None:
+            actions, tick = self.feed.actions_before_tick()
+            for action in actions:
+                self.engine.apply(action)
+            if not tick:
+                self.restart()
+                return
+        else:
+            self.engine.apply(self.policy(self.engine))
+        self.engine.tick()
+        if self.engine.done:
+            if self.replay is not None:
+                # recorded session goes on with the next round,
+                # like replay.play_headless
+                self.engine.model.reinit_round()
+                self.engine.done = False
+                self.engine.steps = 0
+            else:
+                self.restart()
+        self.changed = True
+
+
+class MultiBoard:
+    '''Tiles boards over atlas surface of screen size
+    self.atlas: Surface all grids and scores are drawn on
+    self.boards: list of Board
+    self.scheduler: FixedTimestep making turns of all boards
+    self.merge_rects: number of changed cells of board above which the
+        whole board is copied to screen as one rectangle
+    '''
+    background_color = Color("#808080")
+    fontface = "monospace"
+    fontsize = 12
+    fontcolor = Color("#101010")
+    cell_border = 1
+    merge_rects = 16
+
+    def __init__(self, kind, count, screen_size, policy=None, archive=None,
+                 seed=0, step=0.05, clock=time.monotonic, backend="blit"):
+        '''policy: function of engine returning action, used if archive
+            is not given
+        archive: replay.ReplayArchive, boards play its replays in turn,
+            kind of every board is taken from its replay
+        step: delay between turns in seconds'''
+        self.atlas = pygame.Surface(screen_size)
+        self.atlas.fill(self.background_color)
+        sizes = []
+        for i in range(count):
+            if archive is not None:
+                sizes.append(archive[i % len(archive)].size)
+            else:
+                sizes.append(tournament.ENGINES[kind]().size)
+        columns = int(math.ceil(math.sqrt(count)))
+        rows = int(math.ceil(count / columns))
+        tile_w = screen_size[0] // columns
+        tile_h = screen_size[1] // rows
+        label_h = pygame.font.SysFont(self.fontface,
+                                      self.fontsize).get_linesize()
+        border = self.cell_border
+        cell_step = min(
+            min((tile_w - 2 * border) // w for w, h in sizes),
+            min((tile_h - label_h - 2 * border) // h for w, h in sizes))
+        cell_size = max(1, cell_step - border)
+        self.boards = []
+        for i, size in enumerate(sizes):
+            x = i % columns * tile_w + border
+            y = i // columns * tile_h + border
+            rect = Rect((x, y), (size[0] * (cell_size + border) + border,
+                                 size[1] * (cell_size + border) + border))
+            grid = Grid(size, cell_size, border, rect.topleft, backend,
+                        image=self.atlas.subsurface(rect))
+            if archive is not None:
+                replay = archive[i % len(archive)]
+                board = Board(replay.kind, grid, replay=replay)
+            else:
+                board = Board(kind, grid, seed + i * 1000003, policy)
+            board.score = Score((x, rect.bottom), 6, self.fontface,
+                                self.fontsize, self.fontcolor)
+            self.boards.append(board)
+        self.scheduler = FixedTimestep(step, clock)
+        self.full_redraw = True
+
+    def update(self):
+        '''Makes turns of all boards due, returns number of turns'''
+        ticks = self.scheduler.advance()
+        for tick in range(ticks):
+            for board in self.boards:
+                board.tick()
+        return ticks
+
+    def draw_board(self, board):
+        '''Redraws board on atlas,
+        returns list of changed rectangles (in atlas coordinates)'''
+        board.changed = False
+        grid = board.grid
+        grid.clear()
+        board.engine.model.draw()
+        rects = grid.update()
+        if len(rects) > self.merge_rects:
+            rects = [grid.rect]
+        else:
+            rects = [rect.move(grid.rect.topleft) for rect in rects]
+        board.score.set(board.engine.model.score)
+        if board.score.surfaces is None:
+            if board.score_rect is not None:
+                self.atlas.fill(self.background_color, board.score_rect)
+                rects.append(board.score_rect)
+            board.score_rect = board.score.draw(self.atlas)
+            rects.append(board.score_rect)
+        return rects
+
+    def draw(self, screen):
+        '''Redraws changed boards and copies changed areas of atlas to
+        screen, returns list of changed rectangles of screen'''
+        rects = []
+        for board in self.boards:
+            if board.changed:
+                rects.extend(self.draw_board(board))
+        if self.full_redraw:
+            self.full_redraw = False
+            return [screen.blit(self.atlas, (0, 0))]
+        return [screen.blit(self.atlas, rect, rect) for rect in rects]
+
+
+def main(kind, argv=None):
+    '''Command line entry point of "<kind>.py multi"'''
+    parser = argparse.ArgumentParser(
+        prog=kind + ".py multi",
+        description="Show many " + kind + " boards played by bots or replays")
+    parser.add_argument("-n", "--boards", type=int, default=16,
+                        help="number of boards")
+    parser.add_argument("-p", "--policy", default=DEFAULT_POLICIES[kind],
+                        help="bot policy as module:callable (default " +
+                        DEFAULT_POLICIES[kind] + ")")
+    parser.add_argument("--replay", metavar="FILE",
+                        help="play replays of archive file instead of bots")
+    parser.add_argument("--window", type=tournament.parse_size,
+                        default=(1280, 720), help="window size as WxH")
+    parser.add_argument("--step", type=float, default=0.05,
+                        help="delay between turns in seconds")
+    parser.add_argument("-s", "--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    archive = ReplayArchive(args.replay) if args.replay else None
+    pygame.init()
+    screen = pygame.display.set_mode(args.window)
+    pygame.display.set_caption(kind.capitalize())
+    multi = MultiBoard(kind, args.boards, args.window,
+                       policy=tournament.load_policy(args.policy),
+                       archive=archive, seed=args.seed, step=args.step)
+    clock = pygame.time.Clock()
+    running = True
+    while running:
+        clock.tick(60)
+        for event in pygame.event.get():
+            if event.type == QUIT or \
+                    (event.type == KEYDOWN and event.key == K_ESCAPE):
+                running = False
+        multi.update()
+        pygame.display.update(multi.draw(screen))
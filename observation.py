@@ -0,0 +1,194 @@
+'''Board state of tetris and snake models as contiguous uint8 buffer,
+does not depend on pygame
+
+Observation keeps `frames` frames of the board in one bytearray, frame is
+row-major array of cell codes (EMPTY, OCCUPIED, PIECE, COLLECTIBLE).
+update() writes only cells changed since the previous update, so
+consumers read the board through self.view (memoryview) or self.array
+(numpy array, if numpy is installed) without copying and a step makes no
+allocations. With frames > 1 frames form ring buffer, self.latest is the
+slot of the newest frame, frame(age) returns older ones.
+'''
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from tetris_core import _PIECES
+
+EMPTY = 0
+OCCUPIED = 1
+PIECE = 2
+COLLECTIBLE = 3
+
+
+class Observation:
+    '''Ring buffer of board frames of model
+    self.buffer: bytearray of all frames
+    self.view: memoryview of self.buffer with shape (frames, height, width)
+    self.array: numpy array sharing memory with self.buffer or None
+    self.latest: index of the newest frame
+    self._slots: flat memoryviews of frames, used for copying frames
+    self._frames: memoryviews of frames with shape (height, width)
+    '''
+
+    def __init__(self, model, frames=1):
+        '''model: TetrisModel or SnakeModel to observe
+        frames: number of last frames kept'''
+        width, height = model.grid_size
+        self.frames = frames
+        self.frame_size = width * height
+        self.buffer = bytearray(frames * self.frame_size)
+        self.view = memoryview(self.buffer).cast("B", (frames, height, width))
+        self.array = None
+        if numpy is not None:
+            self.array = numpy.frombuffer(self.buffer, numpy.uint8).reshape(
+                (frames, height, width))
+        flat = memoryview(self.buffer)
+        self._slots = [flat[i * self.frame_size:(i + 1) * self.frame_size]
+                       for i in range(frames)]
+        self._frames = [slot.cast("B", (height, width))
+                        for slot in self._slots]
+        self._empty = bytes(self.frame_size)
+        self.latest = 0
+        self.attach(model)
+
+    def attach(self, model):
+        '''Starts observing model (of the same size), the next update
+        rewrites the whole frame'''
+        self.model = model
+        self.reset()
+
+    def reset(self):
+        '''Forgets drawn state so that the next update rewrites the frame'''
+        pass
+
+    def frame(self, age=0):
+        '''Returns memoryview (height, width) of frame made `age` updates
+        before the newest one'''
+        return self._frames[(self.latest - age) % self.frames]
+
+    def update(self):
+        '''Writes current model state to the next frame'''
+        slot = self._slots[self.latest]
+        if self.frames > 1:
+            self.latest = (self.latest + 1) % self.frames
+            self._slots[self.latest][:] = slot
+            slot = self._slots[self.latest]
+        self.write(slot)
+
+    def write(self, frame):
+        '''Updates flat frame holding the previous state of the model'''
+        raise NotImplementedError
+
+
+class TetrisObservation(Observation):
+    '''Observation of TetrisModel: placed cells are OCCUPIED, cells of
+    current piece are PIECE, placed cells are rewritten only when
+    model.board_version changes'''
+
+    def reset(self):
+        self._version = None
+        self._piece = None
+        self._pos = None
+
+    def write(self, frame):
+        model = self.model
+        width, height = model.grid_size
+        if model.board_version != self._version:
+            self._version = model.board_version
+            frame[:] = self._empty
+            for j, fill in enumerate(model.row_fill):
+                if fill:
+                    for i in range(width):
+                        if model.occupied((i, j)):
+                            frame[j * width + i] = OCCUPIED
+        elif self._piece is not None:
+            x, y = self._pos
+            for i, j in _piece_cells(self._piece):
+                frame[(y + j) * width + x + i] = \
+                    OCCUPIED if model.occupied((x + i, y + j)) else EMPTY
+        self._piece = model.current_piece
+        self._pos = model.current_figure_pos
+        x, y = self._pos
+        for i, j in _piece_cells(self._piece):
+            if 0 <= y + j < height:
+                frame[(y + j) * width + x + i] = PIECE
+
+
+class SnakeObservation(Observation):
+    '''Observation of SnakeModel: body cells are OCCUPIED, head is PIECE,
+    collectibles are COLLECTIBLE
+    self._body: deque of body cells drawn in the newest frame
+    self._moves: model.moves drawn in the newest frame
+    self._collectibles: set of collectibles drawn in the newest frame,
+    moves of the snake since the previous update redraw only new head cells
+    and vacated tail cells'''
+    max_moves = 16
+
+    def reset(self):
+        self._source = None
+        self._moves = None
+        self._body = None
+        self._collectibles = set()
+        self._score = None
+
+    def write(self, frame):
+        model = self.model
+        width = model.grid_size[0]
+        body = model.body_cells
+        if body is not self._source:
+            # new round, body deque is replaced by reinit_round
+            self._source = body
+            self._moves = model.moves
+            self._body = body.copy()
+            self._collectibles = set(model.collectibles)
+            self._score = model.score
+            frame[:] = self._empty
+            for x, y in self._collectibles:
+                frame[y * width + x] = COLLECTIBLE
+            for x, y in body:
+                frame[y * width + x] = OCCUPIED
+            x, y = body[0]
+            frame[y * width + x] = PIECE
+            return
+        if model.score != self._score:
+            self._score = model.score
+            for cell in self._collectibles:
+                if cell not in model.collectibles:
+                    frame[cell[1] * width + cell[0]] = EMPTY
+            self._collectibles.clear()
+            self._collectibles.update(model.collectibles)
+            for x, y in self._collectibles:
+                frame[y * width + x] = COLLECTIBLE
+        moves = model.moves - self._moves
+        if moves > self.max_moves or moves >= len(body):
+            self._source = None
+            self.write(frame)
+            return
+        self._moves = model.moves
+        drawn = self._body
+        x, y = drawn[0]
+        frame[y * width + x] = OCCUPIED
+        for k in range(moves - 1, -1, -1):
+            x, y = body[k]
+            frame[y * width + x] = OCCUPIED
+            drawn.appendleft(body[k])
+        while len(drawn) > len(body):
+            cell = drawn.pop()
+            if cell not in model.occupied:
+                frame[cell[1] * width + cell[0]] = \
+                    COLLECTIBLE if cell in model.collectibles else EMPTY
+        x, y = body[0]
+        frame[y * width + x] = PIECE
+
+
+def _piece_cells(piece):
+    return _PIECES[piece[0]][piece[1]].cells
+
+
+def observe(model, frames=1):
+    '''Returns Observation of TetrisModel or SnakeModel'''
+    if hasattr(model, "body_cells"):
+        return SnakeObservation(model, frames)
+    return TetrisObservation(model, frames)
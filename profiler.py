@@ -0,0 +1,90 @@
+'''Per-phase frame time measurement, does not depend on pygame'''
+import json
+import time
+from collections import deque
+
+
+class FrameProfiler:
+    '''Measures time spent by every frame in its phases,
+    keeps rolling statistics of last frames and sends frame records to sink
+    self.phases: names of phases in frame order
+    self.frames: deque of (start, frame_time, phase_times) of last frames
+    self.sink: object with write(record) and close() or None
+    self.dropped: number of ticks dropped by scheduler, set by end_frame()
+    '''
+    phases = ("events", "propagate", "model_draw", "grid", "hud", "flip")
+
+    def __init__(self, window=120, sink=None, clock=time.perf_counter):
+        self.frames = deque(maxlen=window)
+        self.sink = sink
+        self.clock = clock
+        self.count = 0
+        self.dropped = 0
+        self.frame_start = None
+        self.times = None
+
+    def begin_frame(self):
+        self.frame_start = self.last_mark = self.clock()
+        self.times = dict.fromkeys(self.phases, 0.0)
+
+    def mark(self, phase):
+        '''Adds time elapsed since the last mark to `phase`'''
+        if self.frame_start is None:
+            return
+        now = self.clock()
+        self.times[phase] += now - self.last_mark
+        self.last_mark = now
+
+    def end_frame(self, phase, dropped=0):
+        '''Marks the last phase of frame and stores it,
+        dropped: total number of ticks dropped by scheduler'''
+        if self.frame_start is None:
+            return
+        self.mark(phase)
+        frame_time = self.last_mark - self.frame_start
+        self.frames.append((self.frame_start, frame_time, self.times))
+        self.count += 1
+        if self.sink is not None:
+            self.sink.write({
+                "frame": self.count,
+                "frame_ms": round(frame_time * 1000, 3),
+                "phases_ms": dict((name, round(t * 1000, 3))
+                                  for name, t in self.times.items()),
+                "dropped": dropped - self.dropped,
+            })
+        self.dropped = dropped
+        self.frame_start = None
+
+    def fps(self):
+        '''Returns rolling frames per second'''
+        if len(self.frames) < 2:
+            return 0.0
+        elapsed = self.frames[-1][0] - self.frames[0][0]
+        return (len(self.frames) - 1) / elapsed if elapsed else 0.0
+
+    def worst_frame(self):
+        '''Returns the longest frame time among last frames in seconds'''
+        return max((frame[1] for frame in self.frames), default=0.0)
+
+    def phase_means(self):
+        '''Returns dict of mean times of phases in seconds'''
+        count = len(self.frames) or 1
+        return dict((name, sum(frame[2][name] for frame in self.frames) /
+                     count) for name in self.phases)
+
+    def close(self):
+        if self.sink is not None:
+            self.sink.close()
+
+
+class JsonlSink:
+    '''Writes frame records as JSON lines to file'''
+
+    def __init__(self, path):
+        self.file = open(path, "a")
+
+    def write(self, record):
+        self.file.write(json.dumps(record) + "\n")
+
+    def close(self):
+        self.file.close()
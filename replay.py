@@ -0,0 +1,219 @@
+'''Compact binary replays of tetris and snake sessions,
+does not depend on pygame
+
+Replay layout: header (see HEADER) followed by one byte per record,
+record 0 is a turn of the game (tick), record n > 0 is player's action
+engine.actions[n] applied before the next tick.
+Replay archive is a plain concatenation of replays.
+'''
+import mmap
+import random
+import struct
+
+import snake_core
+import tetris_core
+
+MAGIC = b"PTRP"
+VERSION = 1
+# magic, version, kind, width, height, seed, records count
+HEADER = struct.Struct("<4sBBHHQQ")
+TICK = 0
+# records count of replay which was not closed, records fill the buffer
+UNCLOSED = 0xFFFFFFFFFFFFFFFF
+
+KINDS = ("tetris", "snake")
+ENGINES = {
+    "tetris": tetris_core.TetrisEngine,
+    "snake": snake_core.SnakeEngine,
+}
+
+
+class ReplayError(Exception):
+    pass
+
+
+def new_seed():
+    '''Returns random seed suitable for replay header'''
+    return random.getrandbits(63)
+
+
+class ReplayWriter:
+    '''Records game session to binary file
+    self.codes: dict mapping engine actions to record codes'''
+
+    def __init__(self, path, kind, size, seed):
+        self.kind = kind
+        self.size = size
+        self.seed = seed
+        self.codes = dict((action, code) for code, action
+                          in enumerate(ENGINES[kind].actions) if code)
+        self.count = 0
+        self.file = open(path, "wb")
+        self.file.write(self._header(UNCLOSED))
+
+    def _header(self, count):
+        return HEADER.pack(MAGIC, VERSION, KINDS.index(self.kind),
+                           self.size[0], self.size[1], self.seed, count)
+
+    def action(self, action):
+        '''Records player's action'''
+        self.file.write(bytes((self.codes[action],)))
+        self.count += 1
+
+    def tick(self, ticks=1):
+        '''Records turns of the game'''
+        self.file.write(bytes(ticks))
+        self.count += ticks
+
+    def close(self):
+        '''Writes records count to header and closes file'''
+        self.file.seek(0)
+        self.file.write(self._header(self.count))
+        self.file.close()
+
+
+class Replay:
+    '''Replay stored in buffer (usually mmap) at offset
+    self.records: memoryview of record bytes, no data is copied'''
+
+    def __init__(self, buf, offset=0):
+        if len(buf) - offset < HEADER.size:
+            raise ReplayError("Truncated replay header")
+        magic, version, kind, width, height, seed, count = \
+            HEADER.unpack_from(buf, offset)
+        if magic != MAGIC or version != VERSION or kind >= len(KINDS):
+            raise ReplayError("Not a replay at offset " + str(offset))
+        self.offset = offset
+        self.kind = KINDS[kind]
+        self.size = (width, height)
+        self.seed = seed
+        start = offset + HEADER.size
+        if count == UNCLOSED:
+            # session was interrupted before close, records fill the buffer
+            count = len(buf) - start
+        if start + count > len(buf):
+            raise ReplayError("Truncated replay at offset " + str(offset))
+        self.records = memoryview(buf)[start:start + count]
+        self.end = start + count
+
+    def __len__(self):
+        return len(self.records)
+
+    def actions(self):
+        '''Returns tuple of engine actions indexed by record codes'''
+        return ENGINES[self.kind].actions
+
+
+def _action(actions, code):
+    '''Returns action of record code, raises ReplayError on unknown code'''
+    if code >= len(actions):
+        raise ReplayError("Unknown record code " + str(code))
+    return actions[code]
+
+
+class ReplayArchive:
+    '''Memory-mapped file of one or more concatenated replays,
+    replays are indexed lazily by hopping over their headers,
+    records of taken replays should be released before close()'''
+
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.buf = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.offsets = []
+        self._scan_end = 0
+
+    def _scan(self, index=None):
+        '''Finds replay offsets up to index (or all)'''
+        while (index is None or len(self.offsets) <= index) and \
+                self._scan_end < len(self.buf):
+            replay = Replay(self.buf, self._scan_end)
+            self.offsets.append(self._scan_end)
+            self._scan_end = replay.end
+
+    def __getitem__(self, index):
+        if index < 0:
+            self._scan()
+        else:
+            self._scan(index)
+        return Replay(self.buf, self.offsets[index])
+
+    def __len__(self):
+        self._scan()
+        return len(self.offsets)
+
+    def __iter__(self):
+        index = 0
+        while True:
+            self._scan(index)
+            if index >= len(self.offsets):
+                return
+            yield Replay(self.buf, self.offsets[index])
+            index += 1
+
+    def close(self):
+        self.buf.close()
+        self.file.close()
+
+
+def append_to_archive(archive_path, replay_path):
+    '''Appends replay file to archive file'''
+    with open(replay_path, "rb") as src, open(archive_path, "ab") as dst:
+        while True:
+            chunk = src.read(1 << 20)
+            if not chunk:
+                break
+            dst.write(chunk)
+
+
+def play_headless(replay):
+    '''Plays replay on headless engine as fast as possible,
+    returns list of results of all played rounds'''
+    engine = ENGINES[replay.kind](size=replay.size, seed=replay.seed)
+    actions = replay.actions()
+    rounds = []
+    for code in replay.records:
+        if code == TICK:
+            engine.tick()
+            if engine.done:
+                rounds.append(engine.results())
+                engine.model.reinit_round()
+                engine.done = False
+                engine.steps = 0
+        else:
+            engine.apply(_action(actions, code))
+    rounds.append(engine.results())
+    return rounds
+
+
+class ReplayFeed:
+    '''Feeds replay records to live game model in real time'''
+
+    def __init__(self, replay):
+        self.replay = replay
+        self.actions = replay.actions()
+        self.position = 0
+
+    def actions_before_tick(self):
+        '''Returns (actions, tick), where actions are recorded before
+        next tick and tick is False if replay has ended without the tick'''
+        records = self.replay.records
+        actions = []
+        while self.position < len(records):
+            code = records[self.position]
+            self.position += 1
+            if code == TICK:
+                return actions, True
+            actions.append(_action(self.actions, code))
+        return actions, False
+
+
+def main(kind, args):
+    '''Plays replay headless and prints results of rounds'''
+    archive = ReplayArchive(args.replay)
+    replay = archive[args.replay_index]
+    if replay.kind != kind:
+        raise ReplayError("Replay of " + replay.kind + " game")
+    for number, results in enumerate(play_headless(replay)):
+        print("round {}: {}".format(number, results))
+    replay.records.release()
+    archive.close()
@@ -0,0 +1,88 @@
+'''Ring buffer of game snapshots for rewinding, does not depend on pygame
+
+RewindBuffer keeps snapshots of TetrisModel or SnakeModel taken every
+`interval` seconds of game clock during the last `seconds` seconds,
+the oldest snapshots are dropped. Snapshots are tuples of fields, fields
+unchanged since the previous snapshot are shared with it, so memory is
+counted only for fields which changed, optionally bounded by `max_bytes`.
+'''
+import sys
+from collections import deque
+
+
+def snapshot_size(value):
+    '''Returns estimated size of snapshot field in bytes'''
+    size = sys.getsizeof(value)
+    if isinstance(value, (tuple, frozenset)):
+        size += sum(snapshot_size(item) for item in value)
+    return size
+
+
+class RewindBuffer:
+    '''Snapshots of model for rewinding
+    self.snapshots: deque of (time, snapshot, sizes), the newest last,
+        sizes is list of sizes of fields of snapshot not shared with
+        the older snapshot
+    self.capacity: maximum number of kept snapshots
+    self.size: estimated memory of kept snapshots in bytes
+    '''
+
+    def __init__(self, model, seconds=10.0, interval=0.1, max_bytes=None):
+        '''model: TetrisModel or SnakeModel
+        seconds: length of kept history in seconds of game clock
+        interval: time between snapshots
+        max_bytes: memory budget of snapshots'''
+        self.model = model
+        self.interval = interval
+        self.capacity = max(1, int(round(seconds / interval)))
+        self.max_bytes = max_bytes
+        self.snapshots = deque()
+        self.size = 0
+
+    def record(self):
+        '''Takes snapshot if self.interval has passed since the last one,
+        only active unpaused games are recorded'''
+        model = self.model
+        if model.status != "game_active" or model.pause_status:
+            return False
+        now = model.scheduler.clock()
+        if self.snapshots and now - self.snapshots[-1][0] < self.interval:
+            return False
+        snapshot = model.snapshot()
+        previous = self.snapshots[-1][1] if self.snapshots else ()
+        sizes = [0 if i < len(previous) and field is previous[i]
+                 else snapshot_size(field)
+                 for i, field in enumerate(snapshot)]
+        sizes.append(sys.getsizeof(snapshot))
+        self.snapshots.append((now, snapshot, sizes))
+        self.size += sum(sizes)
+        while len(self.snapshots) > self.capacity or \
+                self.max_bytes is not None and self.size > self.max_bytes \
+                and len(self.snapshots) > 1:
+            self.drop_oldest()
+        return True
+
+    def drop_oldest(self):
+        '''Drops the oldest snapshot, fields it shares with the next one
+        are counted in the next one'''
+        now, snapshot, sizes = self.snapshots.popleft()
+        following, following_sizes = self.snapshots[0][1:]
+        for i, field in enumerate(snapshot):
+            if following[i] is field and not following_sizes[i]:
+                following_sizes[i] = sizes[i]
+                sizes[i] = 0
+        self.size -= sum(sizes)
+
+    def rewind(self):
+        '''Restores the newest snapshot and drops it,
+        returns False if there are no snapshots'''
+        if not self.snapshots:
+            return False
+        now, snapshot, sizes = self.snapshots.pop()
+        self.size -= sum(sizes)
+        self.model.restore(snapshot)
+        return True
+
+    def clear(self):
+        self.snapshots.clear()
+        self.size = 0
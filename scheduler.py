@@ -0,0 +1,61 @@
+'''Fixed-timestep scheduling of game turns, does not depend on pygame'''
+import time
+
+
+class VirtualClock:
+    '''Clock advanced manually, can replace time.monotonic
+    in tests and for fast-forward'''
+
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class FixedTimestep:
+    '''Accumulates elapsed time and converts it into fixed-length ticks
+    self.step: length of one tick in seconds
+    self.clock: function returning current time in seconds
+    self.max_ticks: limit of ticks returned by one advance() call,
+        time of excess ticks is dropped to avoid spiral of death
+    self.dropped: total number of dropped ticks
+    self.accumulator: elapsed time not converted to ticks yet
+    '''
+
+    def __init__(self, step, clock=time.monotonic, max_ticks=8):
+        self.step = step
+        self.clock = clock
+        self.max_ticks = max_ticks
+        self.dropped = 0
+        self.reset()
+
+    def reset(self, step=None):
+        '''Starts accumulation from current time,
+        optionally changes length of tick'''
+        if step is not None:
+            self.step = step
+        self.last_time = self.clock()
+        self.accumulator = 0.0
+
+    def advance(self):
+        '''Returns number of ticks due since the last call'''
+        now = self.clock()
+        self.accumulator += now - self.last_time
+        self.last_time = now
+        ticks = int(self.accumulator // self.step)
+        if ticks > self.max_ticks:
+            self.dropped += ticks - self.max_ticks
+            ticks = self.max_ticks
+            self.accumulator %= self.step
+        else:
+            self.accumulator -= ticks * self.step
+        return ticks
+
+    def alpha(self):
+        '''Returns fraction of the next tick already elapsed,
+        can be used to interpolate rendering between ticks'''
+        return self.accumulator / self.step
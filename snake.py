@@ -1,154 +1,18 @@
+import argparse
+import sys
+
 import pygame
 from pygame.locals import *
 
 
-from grid import Grid
-from game import Score
-import time
-import random
-
-
-class SnakeCollision(Exception):
-    pass
-
-
-class SnakeModel:
-    '''Snake object
-    self.status values:
-        game_active
-        game_over'''
-
-    cell_color = "#FF00FF"
-    collectible_color = "#00FF00"
-
-    def __init__(self, grid_o, length=3, startpos=(-1, -1)):
-        '''self.grid: Grid where Snake moves
-        self.body_cells: array of coordinates of cells composing snake body
-        self.score: current score
-        self.direction: vector of snake direction
-        self.last_active: unix-time of the last move
-        self.move_delay: delay between moves in ms
-        self.expanding: number of moves left which increasing size of snake'''
-        if(startpos == (-1, -1)):
-            startpos = (grid_o.size[0] // 2, grid_o.size[1] // 2)
-        self.length = length
-        self.startpos = startpos
-        self.grid = grid_o
-        self.move_delay = 0.250
-        self.gameover_blink_delay = 0.1
-        self.gameover_blinks = 10
-        self.reinit_round()
-
-    def reinit_round(self):
-        '''Reinitialization of game after start or gameover'''
-        self.score = 0
-        self.body_cells = [(self.startpos[0] - i, self.startpos[1])
-                           for i in range(0, self.length)]
-        self.direction = QueuedValue((1, 0))
-        self.last_active = time.time()
-        self.expanding = 0
-        self.collectibles = []
-        self.place_new_collectible()
-        self.status = "game_active"
-        self.blink_status = True
-        self.blinks_made = 0
-        self.pause_status = False
-
-    def pause_toggle(self):
-        self.pause_status = not self.pause_status
-        self.last_active = time.time()
-
-    def place_new_collectible(self):
-        '''Places snake body piece at random location'''
-        if len(self.body_cells) >= self.grid.size[0] * self.grid.size[1]:
-            return None
-        while True:
-            cell = (random.choice(range(self.grid.size[0])),
-                    random.choice(range(self.grid.size[0])))
-            if not (cell in self.body_cells):
-                self.collectibles.append(cell)
-                return cell
-
-    def make_next_step(self):
-        '''Updates model: hadles snakes's next move'''
-        def pos_sum(pos1, pos2):
-            x1, y1 = pos1
-            x2, y2 = pos2
-            return (x1 + x2, y1 + y2)
-        direction = self.direction.get()
-        next_cell = pos_sum(self.body_cells[0], direction)
-        if next_cell in self.collectibles:
-            self.expanding += 1
-            self.collectibles.remove(next_cell)
-            self.place_new_collectible()
-            self.score += 100
-        if self.expanding == 0:
-            new_cells_list = [next_cell] + self.body_cells[:-1]
-        else:
-            new_cells_list = [next_cell] + self.body_cells
-            self.expanding -= 1
-
-        # check for collisions
-        if next_cell in self.body_cells[:-1]:
-            raise SnakeCollision
-        if next_cell[0] < 0 or next_cell[0] >= self.grid.size[0] or \
-                next_cell[1] < 0 or next_cell[1] >= self.grid.size[1]:
-            raise SnakeCollision
-
-        self.body_cells = new_cells_list
-
-    def set_direction(self, new_direction):
-        '''Changes direction of snake,
-        handles validation and opposite direction cases'''
-        x, y = new_direction
-        if(x < -1 or y < -1 or x > 1 or y > 1 or ((x + y) != 1 and (x + y) != -1)):
-            return False
-        direction = self.direction.observe()
-        '''If direction is the same do nothing'''
-        if(direction == new_direction):
-            return False
-        '''If direction is reverse do nothing'''
-        if(direction[0] + new_direction[0] == 0 and
-           direction[1] + new_direction[1] == 0):
-            return False
-        self.direction.set(new_direction)
-        return True
-
-    def propagate(self):
-        '''Handles time, gamestatuses and calls model update'''
-        c_time = time.time()
-        if self.status == "game_active" and (not self.pause_status):
-            try:
-                if self.last_active + self.move_delay < c_time:
-                    self.last_active += self.move_delay
-                    self.make_next_step()
-            except SnakeCollision:
-                self.status = "game_over"
-        elif self.status == "game_over":
-            if self.last_active + self.gameover_blink_delay < c_time:
-                self.last_active += self.gameover_blink_delay
-                if self.blinks_made >= self.gameover_blinks:
-                    self.reinit_round()
-
-                self.blink_status = not self.blink_status
-                self.blinks_made += 1
-
-    def draw_body(self):
-        '''Draws snake's body cells on the grid'''
-        for c in self.body_cells:
-            self.grid.set_cell_state(c, self.cell_color)
-
-    def draw(self):
-        '''Draws snake and other objects on grid'''
-        # Handle blinking after gameover
-        if self.status == "game_over":
-            if self.blink_status:
-                self.draw_body()
-
-        else:
-            self.draw_body()
-            for c in self.collectibles:
-                self.grid.set_cell_state(c, self.collectible_color)
+import tournament
+from grid import ChunkedGrid, Grid
+from game import ProfilerHud, Score, get_atlas
+from profiler import FrameProfiler, JsonlSink
+from replay import ReplayArchive, ReplayFeed, ReplayWriter, new_seed
+from rewind import RewindBuffer
+from snake_ai import Pilot
+from snake_core import SnakeModel
 
 
 class SnakeGame:
@@ -156,94 +20,276 @@ class SnakeGame:
     fontsize = 24
     fontcolor = Color("#101010")
     background_color = Color("#808080")
-
-    def __init__(self, screen):
+    hud_pos = (350, 60)
+    hud_fontsize = 14
+    rewind_seconds = 10.0
+    rewind_interval = 0.1
+    rewind_max_bytes = None
+    grid_size = (20, 20)
+
+    key_actions = {K_UP: (0, -1), K_w: (0, -1),
+                   K_DOWN: (0, 1), K_s: (0, 1),
+                   K_LEFT: (-1, 0), K_a: (-1, 0),
+                   K_RIGHT: (1, 0), K_d: (1, 0)}
+
+    def __init__(self, screen, recorder=None, replay=None, profile_log=None,
+                 world=None):
+        '''recorder: replay.ReplayWriter to record session to
+        replay: replay.Replay to play instead of handling input
+        profile_log: file to write profiler frame records to
+        world: (width, height) of field bigger than the screen, it is drawn
+            on ChunkedGrid with viewport following the snake'''
         self.screen = screen
         self.background = pygame.Surface(screen.get_size())
         self.background = self.background.convert()
         self.background.fill(self.background_color)
-        self.grid = Grid((20, 20), 15, 1, (20, 10))
-        self.game = SnakeModel(self.grid)
+        size = world or self.grid_size
+        seed = None
+        if replay is not None:
+            size, seed = replay.size, replay.seed
+        elif recorder is not None:
+            size, seed = recorder.size, recorder.seed
+        if size[0] > self.grid_size[0] or size[1] > self.grid_size[1]:
+            self.grid = ChunkedGrid(size, self.grid_size, 15, 1, (20, 10))
+        else:
+            self.grid = Grid(size, 15, 1, (20, 10))
+        self.game = SnakeModel(self.grid, seed=seed)
+        self.recorder = recorder
+        self.feed = ReplayFeed(replay) if replay is not None else None
         self.score = Score((400, 10), 8, self.fontface,
                            self.fontsize, self.fontcolor)
         self.running = True
         self.gameover = False
-        font = pygame.font.SysFont(self.fontface, self.fontsize)
-        self.pause_surf = font.render("Paused", 1, self.fontcolor)
+        self.autopilot = None
+        self.pause_surf = get_atlas(self.fontface, self.fontsize,
+                                    self.fontcolor).text("Paused")
+        self.profile_log = profile_log
+        self.profiler = None
+        self.profiler_hud = None
+        self.full_redraw = True
+        self.hud_rects = []
+        self.rewind = None
 
     def draw_pause_screen(self):
         '''Shows pause status if paused'''
         if self.game.pause_status:
-            self.screen.blit(self.pause_surf, (400, 300))
+            self.hud_rects.append(self.screen.blit(self.pause_surf, (400, 300)))
+
+    def apply_action(self, action):
+        '''Applies player's action to the model and records it,
+        None (no action) is not recorded'''
+        if action is None:
+            return
+        self.game.apply_action(action)
+        if self.recorder is not None:
+            self.recorder.action(action)
+
+    def autopilot_toggle(self):
+        '''Switches Pilot playing instead of the player on and off,
+        fields bigger than Pilot.max_cells are not piloted'''
+        size = self.game.grid_size
+        if self.autopilot or size[0] * size[1] > Pilot.max_cells:
+            self.autopilot = None
+        else:
+            self.autopilot = Pilot()
+
+    def autopilot_ticks(self):
+        '''Makes due moves steering the snake by self.autopilot before
+        every move, records every move right after its action so that
+        replay interleaves them the same way, returns number of moves
+        made'''
+        made = 0
+        for turn in range(self.game.ticks_due()):
+            self.apply_action(self.autopilot.next_action(self.game))
+            made += 1
+            alive = self.game.tick()
+            if self.recorder is not None:
+                self.recorder.tick()
+            if not alive:
+                break
+        return made
+
+    def rewind_update(self):
+        '''Records snapshots of the game and rewinds it while Backspace is
+        held, returns True if the game was rewound'''
+        if self.recorder is not None:
+            # recorded session can not go back in time
+            return False
+        if self.rewind is None or self.rewind.model is not self.game:
+            self.rewind = RewindBuffer(self.game, self.rewind_seconds,
+                                       self.rewind_interval,
+                                       self.rewind_max_bytes)
+        if pygame.key.get_pressed()[K_BACKSPACE]:
+            self.rewind.rewind()
+            return True
+        self.rewind.record()
+        return False
+
+    def profiler_toggle(self):
+        '''Switches frame profiler and its overlay on and off'''
+        if self.profiler is not None:
+            self.profiler.close()
+            self.profiler = self.profiler_hud = None
+            return
+        sink = JsonlSink(self.profile_log) if self.profile_log else None
+        self.profiler = FrameProfiler(sink=sink)
+        self.profiler_hud = ProfilerHud(self.hud_pos, self.fontface,
+                                        self.hud_fontsize, self.fontcolor,
+                                        self.profiler)
+
+    def end_frame(self):
+        '''Finishes profiled frame after display update'''
+        if self.profiler is not None:
+            self.profiler.end_frame("flip", self.game.scheduler.dropped)
+
+    def play_replay(self):
+        '''Makes due moves applying replay actions recorded before them'''
+        if self.game.status != "game_active":
+            self.game.propagate()
+            return
+        for turn in range(self.game.ticks_due()):
+            actions, tick = self.feed.actions_before_tick()
+            for action in actions:
+                self.game.apply_action(action)
+            if not tick:
+                self.running = False
+                return
+            if not self.game.tick():
+                return
 
     def update(self):
         '''Handles input and SnakeModel, Score update'''
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.begin_frame()
         for event in pygame.event.get():
             if event.type == QUIT:
                 self.running = False
             elif event.type == KEYDOWN:
+                if event.key == K_F3:
+                    self.profiler_toggle()
                 if self.game.status == "game_active":
-                    if event.key == K_UP or event.key == K_w:
-                        self.game.set_direction((0, -1))
-
-                    if event.key == K_DOWN or event.key == K_s:
-                        self.game.set_direction((0, 1))
-
-                    if event.key == K_LEFT or event.key == K_a:
-                        self.game.set_direction((-1, 0))
-
-                    if event.key == K_RIGHT or event.key == K_d:
-                        self.game.set_direction((1, 0))
+                    action = self.key_actions.get(event.key)
+                    if action is not None and self.feed is None:
+                        self.apply_action(action)
                     if event.key == K_SPACE or event.key == K_p:
                         self.game.pause_toggle()
-
-        self.game.propagate()
+                    if event.key == K_TAB and self.feed is None:
+                        self.autopilot_toggle()
+
+        if profiler is not None:
+            profiler.mark("events")
+
+        if self.feed is not None:
+            self.play_replay()
+        elif not self.rewind_update():
+            if self.autopilot is not None and \
+                    self.game.status == "game_active":
+                self.autopilot_ticks()
+            else:
+                ticks = self.game.propagate()
+                if ticks and self.recorder is not None:
+                    self.recorder.tick(ticks)
         self.score.set(self.game.score)
+        if profiler is not None:
+            profiler.mark("propagate")
 
     def draw(self):
-        '''Draws game objects on screen'''
-        self.screen.blit(self.background, (0, 0))
-        self.score.draw(self.screen)
+        '''Draws game objects on screen,
+        returns list of changed rectangles of screen'''
+        if self.full_redraw:
+            self.full_redraw = False
+            self.grid.invalidate()
+            dirty = [self.screen.blit(self.background, (0, 0))]
+        else:
+            dirty = [self.screen.blit(self.background, rect, rect)
+                     for rect in self.hud_rects]
+        self.hud_rects = [self.score.draw(self.screen)]
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.mark("hud")
         self.grid.clear()
         self.game.draw()
+        if isinstance(self.grid, ChunkedGrid):
+            self.grid.follow(self.game.body_cells[0])
+        if profiler is not None:
+            profiler.mark("model_draw")
         self.draw_pause_screen()
-        self.grid.draw(self.screen)
-
-
-class QueuedValue:
-    '''Contains a value that can be queued for change or observed or get,
-    queued value remains unobservable before get request'''
-
-    def __init__(self, val):
-        self.queued = val
-        self.val = val
-
-    def set(self, val):
-        '''Queue value for change'''
-        self.queued = val
-
-    def get(self):
-        '''Updates value with queued and returns new'''
-        self.val = self.queued
-        return self.val
-
-    def observe(self):
-        '''Ignores queued value, returns old'''
-        return self.val
+        dirty.extend(self.grid.draw(self.screen))
+        if profiler is not None:
+            profiler.mark("grid")
+            self.hud_rects.append(self.profiler_hud.draw(self.screen))
+            profiler.mark("hud")
+        dirty.extend(self.hud_rects)
+        return dirty
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog="snake.py", epilog="Use \"snake.py tournament --help\" "
+        "for headless bot tournaments, \"snake.py multi --help\" for "
+        "many boards played by bots or replays")
+    parser.add_argument("--record", metavar="FILE",
+                        help="record session to replay file")
+    parser.add_argument("--replay", metavar="FILE",
+                        help="play replay from replay or archive file")
+    parser.add_argument("--replay-index", type=int, default=0,
+                        help="index of replay in archive file")
+    parser.add_argument("--headless", action="store_true",
+                        help="play replay without rendering at full speed")
+    parser.add_argument("--profile-log", metavar="FILE",
+                        help="write JSON lines of frame phase times "
+                        "while profiler (F3) is on")
+    parser.add_argument("--rewind-seconds", type=float, default=10.0,
+                        help="game time kept for rewinding with Backspace")
+    parser.add_argument("--rewind-interval", type=float, default=0.1,
+                        help="game time between rewind snapshots")
+    parser.add_argument("--rewind-memory", type=int, metavar="BYTES",
+                        help="memory budget of rewind snapshots")
+    parser.add_argument("--world", metavar="WxH", type=tournament.parse_size,
+                        help="field size, field bigger than 20x20 "
+                        "scrolls to follow the snake")
+    return parser.parse_args(argv)
 
 
 def main():
+    if sys.argv[1:2] == ["tournament"]:
+        tournament.main("snake", sys.argv[2:])
+        return
+    if sys.argv[1:2] == ["multi"]:
+        import multiboard
+        multiboard.main("snake", sys.argv[2:])
+        return
+    args = parse_args(sys.argv[1:])
+    if args.replay and args.headless:
+        import replay
+        replay.main("snake", args)
+        return
+    recorder = None
+    replay = None
+    if args.replay:
+        replay = ReplayArchive(args.replay)[args.replay_index]
+    elif args.record:
+        recorder = ReplayWriter(args.record, "snake",
+                                args.world or SnakeGame.grid_size, new_seed())
     pygame.init()
     screen = pygame.display.set_mode((650, 350))
     pygame.display.set_caption("Snake")
-    game = SnakeGame(screen)
+    game = SnakeGame(screen, recorder, replay, args.profile_log, args.world)
+    game.rewind_seconds = args.rewind_seconds
+    game.rewind_interval = args.rewind_interval
+    game.rewind_max_bytes = args.rewind_memory
     clock = pygame.time.Clock()
 
     while game.running:
         clock.tick(60)
         game.update()
-        game.draw()
-        pygame.display.flip()
+        pygame.display.update(game.draw())
+        game.end_frame()
+    if game.profiler is not None:
+        game.profiler.close()
+    if recorder is not None:
+        recorder.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,288 @@
+'''Snake autopilot, does not depend on pygame
+
+Pilot heads for collectible along BFS distance field of the board and
+follows Hamiltonian cycle of the field when the greedy step is unsafe.
+Cells are numbered y * width + x. Body cells are kept in cycle order from
+tail to head, so the tail is always reachable by following the cycle and
+the head may skip ahead along the cycle only to cells before the tail.
+'''
+import weakref
+from collections import deque
+
+from observation import COLLECTIBLE, EMPTY, SnakeObservation
+
+
+def hamiltonian_cycle(size):
+    '''Returns list of cells (x, y) of Hamiltonian cycle of field of `size`,
+    None if there is no cycle (both dimensions odd or one is 1)'''
+    width, height = size
+    if width < 2 or height < 2 or width % 2 and height % 2:
+        return None
+    if height % 2:
+        return [(x, y) for y, x in hamiltonian_cycle((height, width))]
+    cycle = []
+    for y in range(height):
+        columns = range(1, width) if y % 2 == 0 else range(width - 1, 0, -1)
+        cycle.extend((x, y) for x in columns)
+    cycle.extend((0, y) for y in range(height - 1, -1, -1))
+    return cycle
+
+
+def field_tables(size):
+    '''Returns (neighbors, orientations) of field of `size`:
+    neighbors: list of lists of (cell, direction) of neighbors of cells
+    orientations: list of (order, successor) of Hamiltonian cycle in both
+        directions, order is list of positions of cells in the cycle and
+        successor is list of cells following them, empty if there is no
+        cycle'''
+    width, height = size
+    count = width * height
+    neighbors = []
+    for y in range(height):
+        for x in range(width):
+            neighbors.append([
+                ((y + dy) * width + x + dx, (dx, dy))
+                for dx, dy in ((0, -1), (1, 0), (0, 1), (-1, 0))
+                if 0 <= x + dx < width and 0 <= y + dy < height])
+    orientations = []
+    cycle = hamiltonian_cycle(size)
+    if cycle is not None:
+        cycle = [y * width + x for x, y in cycle]
+        for cycle in (cycle, cycle[::-1]):
+            order = [0] * count
+            successor = [0] * count
+            for position, cell in enumerate(cycle):
+                order[cell] = position
+                successor[cell] = cycle[(position + 1) % count]
+            orientations.append((order, successor))
+    return neighbors, orientations
+
+
+# field_tables() of field sizes, shared by pilots
+_tables = {}
+
+
+class Pilot:
+    '''Steers SnakeModel to collectibles, gives one action per move
+    self.observation: SnakeObservation used as occupancy bitmap
+    self.neighbors, self.orientations: field_tables() of the field
+    self.order: list of positions of cells in the cycle oriented along
+        the body, None if the field has no cycle or the body does not
+        follow it
+    self.successor: list of cells following cells in the oriented cycle
+    self.dist, self.stamp: distance field to self.target, distance of cell
+        is valid if its stamp equals self.generation
+    self.frontier: deque of cells of unfinished distance field search
+    self.search_budget: cells expanded by the search per move, bigger
+        fields are searched over several moves
+    self.shortcut_fill: fraction of field taken by the snake above which
+        the pilot only follows the cycle
+    self.max_cells: largest field the pilot builds tables for, the tables
+        take about 800 bytes per cell
+    '''
+    search_budget = 200
+    shortcut_fill = 0.5
+    max_cells = 1 << 16
+
+    def __init__(self):
+        self.model = None
+
+    def attach(self, model):
+        '''Prepares cycle and buffers for field of model,
+        raises ValueError if the field is bigger than self.max_cells'''
+        count = model.grid_size[0] * model.grid_size[1]
+        if count > self.max_cells:
+            raise ValueError("Field of {} cells is too big for autopilot"
+                             .format(count))
+        self.model = model
+        self.observation = SnakeObservation(model)
+        tables = _tables.get(model.grid_size)
+        if tables is None:
+            tables = _tables[model.grid_size] = field_tables(model.grid_size)
+        self.neighbors, self.orientations = tables
+        self.order = None
+        self.successor = None
+        self.source = None
+        self.dist = [0] * count
+        self.stamp = [0] * count
+        self.generation = 0
+        self.seen = [0] * count
+        self.visit = 0
+        self.frontier = deque()
+        self.target = None
+
+    def orient(self, body):
+        '''Orients the cycle along body of new round, self.order is None
+        if the body does not follow the cycle in either direction'''
+        self.source = body
+        self.order = self.successor = None
+        width = self.model.grid_size[0]
+        indices = [y * width + x for x, y in reversed(body)]
+        for order, successor in self.orientations:
+            gaps = [(order[cell] - order[indices[0]]) % len(order)
+                    for cell in indices]
+            if all(a < b for a, b in zip(gaps, gaps[1:])):
+                self.order = order
+                self.successor = successor
+                return
+
+    def search(self, frame):
+        '''Expands distance field to the target by self.search_budget cells,
+        starts new search if the target is eaten or self.target is None'''
+        model = self.model
+        width = model.grid_size[0]
+        if self.target not in model.collectibles:
+            self.target = None
+            if not model.collectibles:
+                return
+            hx, hy = model.body_cells[0]
+            self.target = min(model.collectibles,
+                              key=lambda c: abs(c[0] - hx) + abs(c[1] - hy))
+            self.generation += 1
+            start = self.target[1] * width + self.target[0]
+            self.dist[start] = 0
+            self.stamp[start] = self.generation
+            self.frontier.clear()
+            self.frontier.append(start)
+        dist, stamp, generation = self.dist, self.stamp, self.generation
+        frontier = self.frontier
+        for expanded in range(self.search_budget):
+            if not frontier:
+                break
+            cell = frontier.popleft()
+            d = dist[cell] + 1
+            for neighbor, direction in self.neighbors[cell]:
+                if stamp[neighbor] != generation and \
+                        (frame[neighbor] == EMPTY or
+                         frame[neighbor] == COLLECTIBLE):
+                    stamp[neighbor] = generation
+                    dist[neighbor] = d
+                    frontier.append(neighbor)
+
+    def tail_reachable(self, start, tail, frame):
+        '''Checks by BFS over free cells that the tail can be reached after
+        the head moves to `start`, used on fields without cycle'''
+        self.visit += 1
+        seen, visit = self.seen, self.visit
+        seen[start] = visit
+        queue = deque((start,))
+        while queue:
+            cell = queue.popleft()
+            for neighbor, direction in self.neighbors[cell]:
+                if neighbor == tail:
+                    return True
+                if seen[neighbor] != visit and \
+                        (frame[neighbor] == EMPTY or
+                         frame[neighbor] == COLLECTIBLE):
+                    seen[neighbor] = visit
+                    queue.append(neighbor)
+        return False
+
+    def shortcuts(self, head, tail, frame):
+        '''Yields (distance, gap, direction) of free neighbors of head the
+        snake may move to, gap is number of cycle cells skipped by the move,
+        moves ahead of the tail along the cycle (tail reachability) and not
+        past the target are kept if the field has the cycle, moves from
+        which the tail is reachable otherwise'''
+        model = self.model
+        width = model.grid_size[0]
+        order = self.order
+        count = len(self.dist)
+        if order is not None:
+            to_tail = (order[tail] - order[head]) % count
+            to_target = count
+            if self.target is not None:
+                target = self.target[1] * width + self.target[0]
+                to_target = (order[target] - order[head]) % count
+        generation = self.generation
+        for cell, direction in self.neighbors[head]:
+            if frame[cell] != EMPTY and frame[cell] != COLLECTIBLE:
+                continue
+            distance = self.dist[cell] if self.stamp[cell] == generation \
+                else count
+            gap = 0
+            if order is not None:
+                gap = (order[cell] - order[head]) % count
+                # growing snake keeps its tail for `growth` moves
+                growth = model.expanding + (frame[cell] == COLLECTIBLE)
+                if not 0 < gap < to_tail or to_tail - gap - 1 < growth or \
+                        gap > to_target:
+                    continue
+            elif not self.tail_reachable(cell, tail, frame):
+                continue
+            yield distance, gap, direction
+
+    def next_action(self, model):
+        '''Returns direction of the next move of the snake of model'''
+        if model is not self.model:
+            self.attach(model)
+        if model.status != "game_active":
+            return None
+        body = model.body_cells
+        if body is not self.source:
+            self.orient(body)
+        self.observation.update()
+        frame = self.observation.buffer
+        self.search(frame)
+        width = model.grid_size[0]
+        head = body[0][1] * width + body[0][0]
+        tail = body[-1][1] * width + body[-1][0]
+        count = len(self.dist)
+        if self.order is None or len(body) <= self.shortcut_fill * count:
+            best = None
+            for distance, gap, direction in self.shortcuts(head, tail, frame):
+                # nearest to the target, the longest skip while not searched
+                if best is None or (distance, -gap) < best[:2]:
+                    best = (distance, -gap, direction)
+            if best is not None:
+                if best[0] == count and not self.frontier:
+                    # the field is done but blocked by body moved since,
+                    # the search starts again on the next move
+                    self.target = None
+                return best[2]
+        if self.order is not None:
+            following = self.successor[head]
+            for cell, direction in self.neighbors[head]:
+                if cell == following:
+                    return direction
+        # no cycle to follow, any free cell is taken
+        for cell, direction in self.neighbors[head]:
+            if frame[cell] == EMPTY or frame[cell] == COLLECTIBLE or \
+                    cell == tail and not model.expanding:
+                return direction
+        return None
+
+
+def greedy_action(model):
+    '''Returns direction of free neighbor of the head nearest to a
+    collectible, None if there is none, needs no field tables'''
+    hx, hy = model.body_cells[0]
+    width, height = model.grid_size
+    tail = model.body_cells[-1]
+    best = None
+    for dx, dy in ((0, -1), (1, 0), (0, 1), (-1, 0)):
+        x, y = hx + dx, hy + dy
+        if not (0 <= x < width and 0 <= y < height) or \
+                (x, y) in model.occupied and \
+                ((x, y) != tail or model.expanding):
+            continue
+        distance = min((abs(cx - x) + abs(cy - y)
+                        for cx, cy in model.collectibles), default=0)
+        if best is None or distance < best[0]:
+            best = (distance, (dx, dy))
+    return best[1] if best is not None else None
+
+
+_pilots = weakref.WeakKeyDictionary()
+
+
+def policy(engine):
+    '''Tournament policy playing SnakeEngine with Pilot,
+    fields bigger than Pilot.max_cells are played by greedy_action()'''
+    size = engine.model.grid_size
+    if size[0] * size[1] > Pilot.max_cells:
+        return greedy_action(engine.model)
+    pilot = _pilots.get(engine)
+    if pilot is None:
+        pilot = _pilots[engine] = Pilot()
+    return pilot.next_action(engine.model)
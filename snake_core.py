@@ -0,0 +1,419 @@
+'''Snake game model and headless engine, does not depend on pygame'''
+import random
+import time
+from collections import deque
+
+from scheduler import FixedTimestep, VirtualClock
+
+# fields with more cells (bigger than 512x512) use SparseFreeCells
+SPARSE_CELLS = 1 << 18
+
+
+class SnakeCollision(Exception):
+    pass
+
+
+class FreeCells:
+    '''Set of free cells of rectangular field with O(1) add, remove and
+    uniform random choice
+    self.cells: array of free cells in arbitrary order
+    self.index: dict mapping free cells to their positions in self.cells'''
+
+    def __init__(self, size):
+        self.size = size
+        self.cells = [(x, y) for y in range(size[1]) for x in range(size[0])]
+        self.index = dict((cell, i) for i, cell in enumerate(self.cells))
+
+    def __len__(self):
+        return len(self.cells)
+
+    def __contains__(self, cell):
+        return cell in self.index
+
+    def add(self, cell):
+        '''Adds cell, cells outside of the field are ignored'''
+        if cell not in self.index and 0 <= cell[0] < self.size[0] and \
+                0 <= cell[1] < self.size[1]:
+            self.index[cell] = len(self.cells)
+            self.cells.append(cell)
+
+    def remove(self, cell):
+        '''Removes cell by moving the last cell to its place'''
+        i = self.index.pop(cell, None)
+        if i is None:
+            return
+        last = self.cells.pop()
+        if i < len(self.cells):
+            self.cells[i] = last
+            self.index[last] = i
+
+    def choice(self, rand):
+        '''Returns random free cell using random.Random rand'''
+        return self.cells[rand.randrange(len(self.cells))]
+
+
+class SparseFreeCells:
+    '''FreeCells of huge mostly free field, stores only taken cells and
+    chooses free cell by rejection sampling
+    self.taken: set of cells of the field which are not free'''
+
+    def __init__(self, size):
+        self.size = size
+        self.taken = set()
+
+    def __len__(self):
+        return self.size[0] * self.size[1] - len(self.taken)
+
+    def __contains__(self, cell):
+        return 0 <= cell[0] < self.size[0] and \
+            0 <= cell[1] < self.size[1] and cell not in self.taken
+
+    def add(self, cell):
+        self.taken.discard(cell)
+
+    def remove(self, cell):
+        if 0 <= cell[0] < self.size[0] and 0 <= cell[1] < self.size[1]:
+            self.taken.add(cell)
+
+    def choice(self, rand):
+        '''Returns random free cell using random.Random rand'''
+        while True:
+            cell = (rand.randrange(self.size[0]), rand.randrange(self.size[1]))
+            if cell not in self.taken:
+                return cell
+
+
+def free_cells_of(size):
+    '''Returns FreeCells of field of `size`, SparseFreeCells for huge one'''
+    if size[0] * size[1] > SPARSE_CELLS:
+        return SparseFreeCells(size)
+    return FreeCells(size)
+
+
+class SnakeModel:
+    '''Snake object
+    self.status values:
+        game_active
+        game_over'''
+
+    cell_color = "#FF00FF"
+    collectible_color = "#00FF00"
+
+    def __init__(self, grid_o=None, length=3, startpos=(-1, -1),
+                 size=None, seed=None, clock=time.monotonic, collectibles=1):
+        '''self.grid: Grid where Snake moves, None for headless model
+        self.grid_size: (width, height) of field, taken from grid
+            if size is not given
+        self.random: random.Random generator of collectibles positions
+        self.body_cells: deque of coordinates of cells composing snake body,
+            head first
+        self.occupied: dict mapping body cells to number of body parts in
+            them, gives O(1) collision checks
+        self.collectibles: set of cells with collectibles
+        self.collectibles_count: number of collectibles on the field
+        self.free_cells: FreeCells (SparseFreeCells for huge field) not
+            taken by body or collectibles
+        self.score: current score
+        self.direction: vector of snake direction
+        self.move_delay: delay between moves in seconds
+        self.scheduler: FixedTimestep producing moves every self.move_delay
+            and blinks every self.gameover_blink_delay after game over
+        self.expanding: number of moves left which increasing size of snake
+        self.moves: number of moves made in current round'''
+        self.grid = grid_o
+        self.grid_size = size if size else grid_o.size
+        self.random = random.Random(seed)
+        if(startpos == (-1, -1)):
+            startpos = (self.grid_size[0] // 2, self.grid_size[1] // 2)
+        self.length = length
+        self.startpos = startpos
+        self.move_delay = 0.250
+        self.gameover_blink_delay = 0.1
+        self.gameover_blinks = 10
+        self.collectibles_count = collectibles
+        self.scheduler = FixedTimestep(self.move_delay, clock)
+        self._saved_random = None
+        self.free_cells = free_cells_of(self.grid_size)
+        self.occupied = {}
+        self.collectibles = set()
+        self.reinit_round()
+
+    def reinit_round(self):
+        '''Reinitialization of game after start or gameover,
+        free cells of the previous round are patched, not rebuilt'''
+        taken = self.occupied.keys() | self.collectibles
+        self.score = 0
+        self.body_cells = deque((self.startpos[0] - i, self.startpos[1])
+                                for i in range(0, self.length))
+        self.occupied = {}
+        for cell in self.body_cells:
+            self.occupied[cell] = self.occupied.get(cell, 0) + 1
+        self.collectibles = set()
+        self._retake_cells(taken)
+        self.direction = QueuedValue((1, 0))
+        self.scheduler.reset(self.move_delay)
+        self.expanding = 0
+        self.moves = 0
+        for i in range(self.collectibles_count):
+            self.place_new_collectible()
+        self.status = "game_active"
+        self.blink_status = True
+        self.blinks_made = 0
+        self.pause_status = False
+
+    def snapshot(self):
+        '''Returns immutable snapshot of game state for restore(),
+        random generator state is shared with previous snapshots while
+        no collectible is placed'''
+        if self._saved_random is None:
+            self._saved_random = self.random.getstate()
+        return (tuple(self.body_cells), frozenset(self.collectibles),
+                self._saved_random, self.direction.val,
+                self.direction.queued, self.expanding, self.score,
+                self.moves, self.status)
+
+    def restore(self, snapshot):
+        '''Returns game to the state of snapshot(), free cells are patched
+        with cells taken in only one of the current and restored states,
+        so their order and collectibles placed later may differ from the
+        game which made the snapshot'''
+        (body, collectibles, random_state, direction, queued,
+         self.expanding, self.score, self.moves, self.status) = snapshot
+        taken = self.occupied.keys() | self.collectibles
+        self.body_cells = deque(body)
+        self.collectibles = set(collectibles)
+        self.occupied = {}
+        for cell in self.body_cells:
+            self.occupied[cell] = self.occupied.get(cell, 0) + 1
+        self._retake_cells(taken)
+        self.direction = QueuedValue(direction)
+        self.direction.set(queued)
+        self.random.setstate(random_state)
+        self._saved_random = random_state
+        self.blink_status = True
+        self.blinks_made = 0
+        self.scheduler.reset(self.move_delay)
+
+    def _retake_cells(self, taken):
+        '''Updates self.free_cells from cells `taken` by the previous state
+        to cells of self.occupied and self.collectibles'''
+        now_taken = self.occupied.keys() | self.collectibles
+        for cell in taken - now_taken:
+            self.free_cells.add(cell)
+        for cell in now_taken - taken:
+            self.free_cells.remove(cell)
+
+    def pause_toggle(self):
+        self.pause_status = not self.pause_status
+        self.scheduler.reset()
+
+    def place_new_collectible(self):
+        '''Places snake body piece at random free location'''
+        if not self.free_cells:
+            return None
+        self._saved_random = None
+        cell = self.free_cells.choice(self.random)
+        self.free_cells.remove(cell)
+        self.collectibles.add(cell)
+        return cell
+
+    def make_next_step(self):
+        '''Updates model: hadles snakes's next move'''
+        direction = self.direction.get()
+        head = self.body_cells[0]
+        next_cell = (head[0] + direction[0], head[1] + direction[1])
+        if next_cell in self.collectibles:
+            self.expanding += 1
+            self.collectibles.remove(next_cell)
+            self.place_new_collectible()
+            self.score += 100
+
+        # check for collisions, tail cell is vacated first
+        tail = self.body_cells[-1]
+        if next_cell in self.occupied and \
+                (next_cell != tail or self.occupied[tail] > 1):
+            raise SnakeCollision
+        if next_cell[0] < 0 or next_cell[0] >= self.grid_size[0] or \
+                next_cell[1] < 0 or next_cell[1] >= self.grid_size[1]:
+            raise SnakeCollision
+
+        if self.expanding == 0:
+            self.body_cells.pop()
+            if self.occupied[tail] == 1:
+                del self.occupied[tail]
+                if tail not in self.collectibles:
+                    self.free_cells.add(tail)
+            else:
+                self.occupied[tail] -= 1
+        else:
+            self.expanding -= 1
+        self.body_cells.appendleft(next_cell)
+        self.occupied[next_cell] = self.occupied.get(next_cell, 0) + 1
+        self.free_cells.remove(next_cell)
+        self.moves += 1
+
+    def set_direction(self, new_direction):
+        '''Changes direction of snake,
+        handles validation and opposite direction cases'''
+        x, y = new_direction
+        if(x < -1 or y < -1 or x > 1 or y > 1 or ((x + y) != 1 and (x + y) != -1)):
+            return False
+        direction = self.direction.observe()
+        '''If direction is the same do nothing'''
+        if(direction == new_direction):
+            return False
+        '''If direction is reverse do nothing'''
+        if(direction[0] + new_direction[0] == 0 and
+           direction[1] + new_direction[1] == 0):
+            return False
+        self.direction.set(new_direction)
+        return True
+
+    def apply_action(self, action):
+        '''Applies player's action (one of SnakeEngine.actions),
+        returns True if direction has changed'''
+        if action is None:
+            return False
+        return self.set_direction(action)
+
+    def tick(self):
+        '''Makes one move of the snake, returns False on collision'''
+        try:
+            self.make_next_step()
+        except SnakeCollision:
+            self.status = "game_over"
+            self.scheduler.step = self.gameover_blink_delay
+            return False
+        return True
+
+    def ticks_due(self):
+        '''Returns number of moves due according to self.scheduler'''
+        if self.status != "game_active" or self.pause_status:
+            return 0
+        return self.scheduler.advance()
+
+    def propagate(self):
+        '''Handles time, gamestatuses and calls model update
+        Returns number of moves made'''
+        if self.status == "game_over":
+            for blink in range(self.scheduler.advance()):
+                if self.blinks_made >= self.gameover_blinks:
+                    self.reinit_round()
+                    break
+                self.blink_status = not self.blink_status
+                self.blinks_made += 1
+            return 0
+        ticks = self.ticks_due()
+        for made in range(ticks):
+            if not self.tick():
+                return made + 1
+        return ticks
+
+    def draw_body(self):
+        '''Draws snake's body cells on the grid'''
+        for c in self.body_cells:
+            self.grid.set_cell_state(c, self.cell_color)
+
+    def draw(self):
+        '''Draws snake and other objects on grid'''
+        # Handle blinking after gameover
+        if self.status == "game_over":
+            if self.blink_status:
+                self.draw_body()
+
+        else:
+            self.draw_body()
+            for c in self.collectibles:
+                self.grid.set_cell_state(c, self.collectible_color)
+
+
+class QueuedValue:
+    '''Contains a value that can be queued for change or observed or get,
+    queued value remains unobservable before get request'''
+
+    def __init__(self, val):
+        self.queued = val
+        self.val = val
+
+    def set(self, val):
+        '''Queue value for change'''
+        self.queued = val
+
+    def get(self):
+        '''Updates value with queued and returns new'''
+        self.val = self.queued
+        return self.val
+
+    def observe(self):
+        '''Ignores queued value, returns old'''
+        return self.val
+
+
+class SnakeEngine:
+    '''Headless snake simulation advanced by explicit steps,
+    reads no clock and does not need pygame
+    self.model: SnakeModel without grid
+    self.steps: number of moves made since reset
+    self.done: True after collision, reset() starts new game
+    self.observation: observation.SnakeObservation made by observe() or None
+    actions: None or direction vector (dx, dy)
+    '''
+    actions = (None, (0, -1), (0, 1), (-1, 0), (1, 0))
+
+    def __init__(self, size=(20, 20), seed=None, length=3):
+        self.size = size
+        self.length = length
+        self.observation = None
+        self.reset(seed)
+
+    def reset(self, seed=None):
+        '''Starts new game with collectibles generated from seed'''
+        self.model = SnakeModel(length=self.length, size=self.size, seed=seed,
+                                clock=VirtualClock())
+        self.steps = 0
+        self.done = False
+        if self.observation is not None:
+            self.observation.attach(self.model)
+            self.observation.update()
+
+    def observe(self, frames=1):
+        '''Returns observation.SnakeObservation of the game kept up to date
+        by reset() and tick(), actions applied by apply() show up after
+        the next tick()'''
+        from observation import SnakeObservation
+        self.observation = SnakeObservation(self.model, frames)
+        self.observation.update()
+        return self.observation
+
+    def apply(self, action):
+        '''Applies player's action without advancing the game,
+        returns True if direction has changed'''
+        if self.done:
+            return False
+        return self.model.apply_action(action)
+
+    def tick(self):
+        '''Makes one move of the snake, returns (reward, done)'''
+        if self.done:
+            return 0, True
+        score = self.model.score
+        self.steps += 1
+        self.done = not self.model.tick()
+        if self.observation is not None:
+            self.observation.update()
+        return self.model.score - score, self.done
+
+    def step(self, action):
+        '''Applies action and makes one move, returns (reward, done)'''
+        self.apply(action)
+        return self.tick()
+
+    def results(self):
+        '''Returns dict of current game results'''
+        return {"score": self.model.score,
+                "length": len(self.model.body_cells), "steps": self.steps}
+
+
+def random_policy(engine):
+    '''Policy choosing random direction, uses global random generator'''
+    return random.choice(engine.actions)
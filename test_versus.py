@@ -0,0 +1,88 @@
+'''Versus server and clients over localhost, run with
+python3 -m unittest test_versus'''
+import asyncio
+import json
+import unittest
+
+from scheduler import VirtualClock
+from versus import BotClient, VersusServer, board_state, encode
+
+
+class VersusTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.clock = VirtualClock()
+        self.server = VersusServer(seed=1, clock=self.clock)
+        await self.server.start()
+        self.clients = []
+        self.tasks = []
+
+    async def asyncTearDown(self):
+        for client in self.clients:
+            client.close()
+        for task in self.tasks:
+            task.cancel()
+        await self.server.close()
+
+    async def play(self, ticks):
+        '''Advances server clock by `ticks` ticks letting all tasks run'''
+        for tick in range(ticks):
+            self.clock.advance(1.0 / self.server.tick_rate)
+            await asyncio.sleep(0.01)
+
+    async def start_bots(self):
+        for i in range(2):
+            client = BotClient()
+            client.think_delay = 0.005
+            await client.connect("127.0.0.1", self.server.port)
+            self.clients.append(client)
+            self.tasks.append(asyncio.ensure_future(client.play()))
+
+    async def settle(self):
+        '''Stops clients and waits until sent messages are handled'''
+        for client in self.clients:
+            client.think_delay = 3600
+        await asyncio.sleep(0.1)
+
+    async def test_bots_receive_acks_and_deltas(self):
+        await self.start_bots()
+        await self.play(90)
+        await self.settle()
+        server = self.server
+        self.assertGreater(server.tick, 0)
+        self.assertEqual(server.round, 1)
+        for client in self.clients:
+            player = server.players[client.player]
+            opponent = server.players[1 - client.player]
+            self.assertGreater(client.seq, 0)
+            self.assertGreater(player.ack, 0)
+            # all acknowledged actions are dropped from prediction
+            self.assertTrue(all(seq > player.ack
+                                for seq, action in client.pending))
+            # deltas applied by client rebuild server state
+            self.assertEqual(client.state, board_state(player.model))
+            self.assertEqual(client.opponent_state,
+                             board_state(opponent.model))
+            self.assertEqual(client.model.rows,
+                             client.state["rows"])
+
+    async def test_malformed_action_disconnects_sender(self):
+        await self.start_bots()
+        reader, writer = await asyncio.open_connection("127.0.0.1",
+                                                       self.server.port)
+        self.assertIn("error", json.loads(await reader.readline()))
+        writer.close()
+        await self.play(10)
+        # unhashable action of a player must not stop the server
+        bad = self.clients[0]
+        bad.writer.write(encode({"seq": bad.seq + 1, "a": ["x"]}))
+        await self.play(10)
+        tick = self.server.tick
+        await self.play(10)
+        self.assertFalse(self.server.task.done())
+        self.assertGreater(self.server.tick, tick)
+        self.assertEqual(len(self.server.players), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,230 +1,17 @@
-import random
-import time
-import operator
+import argparse
+import asyncio
+import sys
 
 import pygame
 from pygame.locals import *
 
 from grid import Grid
-from game import Score
-
-_FIGURES_unproc = [
-    [
-        ["X", "X"],
-        ["X", "X"]
-    ],
-    [
-        [" ", "X", " "],
-        ["X", "X", "X"],
-        [" ", " ", " "]],
-    [
-        ["X", " ", " "],
-        ["X", "X", " "],
-        [" ", "X", " "]
-    ],
-    [
-        [" ", " ", "X", " "],
-        [" ", " ", "X", " "],
-        [" ", " ", "X", " "],
-        [" ", " ", "X", " "]
-    ],
-    [
-        ["X", " ", " "],
-        ["X", "X", "X"],
-        [" ", " ", " "]
-    ]
-]
-
-
-def rotate_figure(figure):
-    '''Returns rotated figure, presented as 2d-array'''
-    n = len(figure)
-    m = len(figure[0])
-    r_figure = [[" " for i in range(n)] for j in range(m)]
-    for i in range(n):
-        for j in range(m):
-            r_figure[j][i] = figure[i][m - 1 - j]
-    return r_figure
-
-
-def preprocess_figures(figures_unproc):
-    '''Converts an array of figures to an array of arrays of length 4
-    of all rotations of corresponding figures'''
-    def all_rotations(figure):
-        f_rot = []
-        for j in range(0, 4):
-            f_rot.append(figure)
-            figure = rotate_figure(figure)
-        return f_rot
-
-    figures = list(map(all_rotations, figures_unproc))
-    return figures
-
-
-_FIGURES = preprocess_figures(_FIGURES_unproc)
-
-
-class TetrisGameOver(Exception):
-    pass
-
-
-class TetrisModel:
-    '''Model of tetris game
-    self.grid: rectangular grid of playing field, Grid object
-    self.placed_cells: 2-d array of placed pieces of figures,
-        element is pygame Color of the cell
-    self.grid_size: dimensions of self.placed_cells
-    format of figure: 2d-array in FIGURE format
-    self.next_figure: figure text to appear
-    self.current_figure: figgure currently playing
-    self.current_figure_pos position of figure on a field
-    self.score: players score
-    self.last_active: unix-time of last turn-based move
-    self.status: status of the game:
-        "game_active" for running game
-        "game_over" for ended game
-    '''
-    cell_color = "#FF00FF"
-    move_delay = 0.250
-
-    def __init__(self, grid):
-        self.grid = grid
-        self.reinit_round()
-
-    def reinit_round(self):
-        '''Reinitilizes game after start or gameover'''
-        self.next_figure = self.random_figure()
-        self.grid_size = self.grid.size
-        self.placed_cells = [
-            [None for y in range(self.grid.size[1])]
-            for x in range(self.grid.size[0])]
-        self.take_next_figure()
-        self.score = 0
-        self.last_active = time.time()
-        self.pause_status = False
-        self.status = "game_active"
-
-    def pause_toggle(self):
-        '''Sets game on pause'''
-        self.pause_status = not self.pause_status
-        self.last_active = time.time()
-
-    def random_figure(self):
-        '''Returns random tetris figue'''
-        fig_i = random.randint(0, len(_FIGURES) - 1)
-        rot_i = random.randint(0, 4 - 1)
-        return _FIGURES[fig_i][rot_i]
-
-    def take_next_figure(self):
-        '''Replaces current playing figure with next'''
-        next_figure = self.random_figure()
-        figure_pos = (
-            (self.grid.size[0] - len(self.next_figure)) // 2, 0)
-        if self.collides(next_figure, figure_pos):
-            raise TetrisGameOver
-        self.current_figure = self.next_figure
-        self.next_figure = next_figure
-        self.current_figure_pos = figure_pos
-
-    def rotation_move(self):
-        '''Rotates current playing figure'''
-        new_figure = rotate_figure(self.current_figure)
-        if self.collides(new_figure, self.current_figure_pos):
-            return False
-        else:
-            self.current_figure = new_figure
-            return True
-
-    def collides(self, figure, pos):
-        '''Checks collision of `figure` at `pos` with the occupied cells'''
-        for i in range(len(figure)):
-            for j in range(len(figure[0])):
-                if figure[i][j] != " ":
-                    shift_pos = tuple(map(operator.add, pos, (i, j)))
-                    in_range_i = (shift_pos[0] >= 0) and \
-                        (shift_pos[0] < self.grid_size[0])
-                    in_range_j = (shift_pos[1] + j >= 0) and \
-                        (shift_pos[1] < self.grid_size[1])
-                    if (not in_range_i) or (not in_range_j) or \
-                            self.placed_cells[shift_pos[0]][shift_pos[1]]:
-                        return True
-        return False
-
-    def make_next_step(self):
-        '''Proceed to next step of turn-based game'''
-        def get_full_line():
-            for j in range(self.grid_size[1]):
-                full = True
-                for i in range(self.grid_size[0]):
-                    if self.placed_cells[i][j] is None:
-                        full = False
-                if full:
-                    return j
-            return None
-
-        def remove_line(line_num):
-            for i in range(self.grid_size[0]):
-                self.placed_cells[i][0] = None
-                for j in range(line_num - 1, 0, -1):
-                    self.placed_cells[i][j + 1] = self.placed_cells[i][j]
-
-        def remove_full_lines():
-            full_lines = 0
-            while True:
-                line_num = get_full_line()
-                if line_num is None:
-                    break
-                full_lines += 1
-                remove_line(line_num)
-            self.score += full_lines * (full_lines + 1) * 50
-
-        def place_piece(figure, pos):
-            for i in range(len(figure)):
-                for j in range(len(figure[0])):
-                    if figure[i][j] != " ":
-                        self.placed_cells[pos[0] + i][pos[1] + j] = self.cell_color
-
-        if not self.move_figure((0, 1)):
-            place_piece(self.current_figure, self.current_figure_pos)
-            remove_full_lines()
-            self.take_next_figure()
-
-    def move_figure(self, dir):
-        '''Moves current playing figure in direction'''
-        new_pos = tuple(map(operator.add, self.current_figure_pos, dir))
-        if self.collides(self.current_figure, new_pos):
-            return False
-        else:
-            self.current_figure_pos = new_pos
-            return True
-
-    def propagate(self):
-        '''Continue process game, should be called on each frame.abs
-        Handles time, gamestatuses and calls model update'''
-        c_time = time.time()
-        if self.status == "game_active" and (not self.pause_status):
-            try:
-                if self.last_active + self.move_delay < c_time:
-                    self.last_active += self.move_delay
-                    self.make_next_step()
-            except TetrisGameOver:
-                self.status = "game_over"
-        elif self.status == "game_over":
-            self.reinit_round()
-
-    def draw(self):
-        '''Draws game objects on grid'''
-        for i in range(self.grid.size[0]):
-            for j in range(self.grid.size[1]):
-                if(self.placed_cells[i][j] is not None):
-                    self.grid.set_cell_state((i, j), self.placed_cells[i][j])
-
-        for i in range(len(self.current_figure)):
-            for j in range(len(self.current_figure[1])):
-                if(self.current_figure[i][j] != " "):
-                    shift_pos = tuple(map(operator.add,
-                                          self.current_figure_pos, (i, j)))
-                    self.grid.set_cell_state(shift_pos, self.cell_color)
+from game import ProfilerHud, Score, get_atlas
+from profiler import FrameProfiler, JsonlSink
+from replay import ReplayArchive, ReplayFeed, ReplayWriter, new_seed
+from rewind import RewindBuffer
+from tetris_ai import AutoPlayer
+from tetris_core import TetrisModel, BitboardTetrisModel, TetrisGameOver
 
 
 class TetrisGame:
@@ -232,72 +19,375 @@ class TetrisGame:
     fontsize = 24
     fontcolor = Color("#101010")
     background_color = Color("#808080")
+    hud_pos = (200, 60)
+    hud_fontsize = 14
+    rewind_seconds = 10.0
+    rewind_interval = 0.1
+    rewind_max_bytes = None
+    grid_size = (10, 20)
     initial_delay = 0.10
     repeat_delay = 0.05
 
-    def __init__(self, screen):
+    key_actions = {K_UP: "rotate", K_w: "rotate",
+                   K_LEFT: "left", K_a: "left",
+                   K_RIGHT: "right", K_d: "right",
+                   K_DOWN: "down", K_s: "down",
+                   K_RETURN: "drop"}
+
+    def __init__(self, screen, recorder=None, replay=None, profile_log=None):
+        '''recorder: replay.ReplayWriter to record session to
+        replay: replay.Replay to play instead of handling input
+        profile_log: file to write profiler frame records to'''
         self.screen = screen
         self.background = pygame.Surface(screen.get_size())
         self.background = self.background.convert()
         self.background.fill(self.background_color)
-        self.grid = Grid((10, 20), 15, 1, (20, 10))
-        self.game = TetrisModel(self.grid)
+        size = self.grid_size
+        seed = None
+        if replay is not None:
+            size, seed = replay.size, replay.seed
+        elif recorder is not None:
+            size, seed = recorder.size, recorder.seed
+        self.grid = Grid(size, 15, 1, (20, 10))
+        self.game = TetrisModel(self.grid, seed=seed)
+        self.recorder = recorder
+        self.feed = ReplayFeed(replay) if replay is not None else None
         self.score = Score((300, 10), 8, self.fontface,
                            self.fontsize, self.fontcolor)
         self.running = True
-        font = pygame.font.SysFont(self.fontface, self.fontsize)
-        self.pause_surf = font.render("Paused", 1, self.fontcolor)
+        self.pause_surf = get_atlas(self.fontface, self.fontsize,
+                                    self.fontcolor).text("Paused")
+        self.autoplayer = None
+        self.profile_log = profile_log
+        self.profiler = None
+        self.profiler_hud = None
+        self.full_redraw = True
+        self.hud_rects = []
+        self.rewind = None
         pygame.key.set_repeat(int(self.initial_delay * 1000),
                               int(self.repeat_delay * 1000))
 
     def draw_pause_screen(self):
         '''Shows pause status if paused'''
         if self.game.pause_status:
-            self.screen.blit(self.pause_surf, (350, 300))
+            self.hud_rects.append(self.screen.blit(self.pause_surf, (350, 300)))
+
+    def apply_action(self, action):
+        '''Applies player's action to the model and records it'''
+        self.game.apply_action(action)
+        if self.recorder is not None:
+            self.recorder.action(action)
+
+    def autoplay_toggle(self):
+        '''Switches AutoPlayer playing instead of the player on and off'''
+        self.autoplayer = None if self.autoplayer else AutoPlayer()
+
+    def rewind_update(self):
+        '''Records snapshots of the game and rewinds it while Backspace is
+        held, returns True if the game was rewound'''
+        if self.recorder is not None:
+            # recorded session can not go back in time
+            return False
+        if self.rewind is None or self.rewind.model is not self.game:
+            self.rewind = RewindBuffer(self.game, self.rewind_seconds,
+                                       self.rewind_interval,
+                                       self.rewind_max_bytes)
+        if pygame.key.get_pressed()[K_BACKSPACE]:
+            self.rewind.rewind()
+            return True
+        self.rewind.record()
+        return False
+
+    def profiler_toggle(self):
+        '''Switches frame profiler and its overlay on and off'''
+        if self.profiler is not None:
+            self.profiler.close()
+            self.profiler = self.profiler_hud = None
+            return
+        sink = JsonlSink(self.profile_log) if self.profile_log else None
+        self.profiler = FrameProfiler(sink=sink)
+        self.profiler_hud = ProfilerHud(self.hud_pos, self.fontface,
+                                        self.hud_fontsize, self.fontcolor,
+                                        self.profiler)
+
+    def end_frame(self):
+        '''Finishes profiled frame after display update'''
+        if self.profiler is not None:
+            self.profiler.end_frame("flip", self.game.scheduler.dropped)
+
+    def play_replay(self):
+        '''Makes due turns applying replay actions recorded before them'''
+        if self.game.status != "game_active":
+            self.game.propagate()
+            return
+        for turn in range(self.game.ticks_due()):
+            actions, tick = self.feed.actions_before_tick()
+            for action in actions:
+                self.game.apply_action(action)
+            if not tick:
+                self.running = False
+                return
+            if not self.game.tick():
+                return
 
     def update(self):
-        '''Handles input and SnakeModel, Score update'''
+        '''Handles input and TetrisModel, Score update'''
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.begin_frame()
         for event in pygame.event.get():
             if event.type == QUIT:
                 self.running = False
             elif event.type == KEYDOWN:
+                if event.key == K_F3:
+                    self.profiler_toggle()
                 if self.game.status == "game_active":
-                    if event.key == K_UP or event.key == K_w:
-                        self.game.rotation_move()
-                    if event.key == K_LEFT or event.key == K_a:
-                        self.game.move_figure((-1, 0))
-                    if event.key == K_RIGHT or event.key == K_d:
-                        self.game.move_figure((1, 0))
-                    if event.key == K_DOWN or event.key == K_s:
-                        self.game.move_figure((0, 1))
+                    action = self.key_actions.get(event.key)
+                    if action is not None and self.feed is None:
+                        self.apply_action(action)
                     if event.key == K_SPACE or event.key == K_p:
                         self.game.pause_toggle()
-
-        self.game.propagate()
+                    if event.key == K_TAB and self.feed is None:
+                        self.autoplay_toggle()
+
+        if profiler is not None:
+            profiler.mark("events")
+
+        if self.feed is not None:
+            self.play_replay()
+        elif not self.rewind_update():
+            if self.autoplayer is not None and \
+                    self.game.status == "game_active" and \
+                    not self.game.pause_status:
+                self.apply_action(self.autoplayer.next_action(self.game))
+            ticks = self.game.propagate()
+            if ticks and self.recorder is not None:
+                self.recorder.tick(ticks)
         self.score.set(self.game.score)
+        if profiler is not None:
+            profiler.mark("propagate")
 
     def draw(self):
-        '''Draws game objects on screen'''
-        self.screen.blit(self.background, (0, 0))
-        self.score.draw(self.screen)
+        '''Draws game objects on screen,
+        returns list of changed rectangles of screen'''
+        if self.full_redraw:
+            self.full_redraw = False
+            self.grid.invalidate()
+            dirty = [self.screen.blit(self.background, (0, 0))]
+        else:
+            dirty = [self.screen.blit(self.background, rect, rect)
+                     for rect in self.hud_rects]
+        self.hud_rects = [self.score.draw(self.screen)]
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.mark("hud")
         self.grid.clear()
         self.game.draw()
+        if profiler is not None:
+            profiler.mark("model_draw")
         self.draw_pause_screen()
-        self.grid.draw(self.screen)
+        dirty.extend(self.grid.draw(self.screen))
+        if profiler is not None:
+            profiler.mark("grid")
+            self.hud_rects.append(self.profiler_hud.draw(self.screen))
+            profiler.mark("hud")
+        dirty.extend(self.hud_rects)
+        return dirty
+
+
+class VersusGame:
+    '''Rendered client of versus.VersusServer, own board on the left,
+    opponent's board on the right'''
+    fontface = TetrisGame.fontface
+    fontsize = TetrisGame.fontsize
+    fontcolor = TetrisGame.fontcolor
+    background_color = TetrisGame.background_color
+    key_actions = TetrisGame.key_actions
+
+    def __init__(self, screen):
+        import versus
+        self.screen = screen
+        self.background = pygame.Surface(screen.get_size())
+        self.background = self.background.convert()
+        self.background.fill(self.background_color)
+        self.grid = Grid(versus.VersusServer.size, 15, 1, (20, 10))
+        self.opponent_grid = Grid(versus.VersusServer.size, 10, 1, (440, 80))
+        self.client = versus.VersusClient((self.grid, self.opponent_grid))
+        self.score = Score((190, 10), 8, self.fontface,
+                           self.fontsize, self.fontcolor)
+        self.opponent_score = Score((440, 60), 8, self.fontface, 14,
+                                    self.fontcolor)
+        self.running = True
+        self.full_redraw = True
+        self.hud_rects = []
+        pygame.key.set_repeat(int(TetrisGame.initial_delay * 1000),
+                              int(TetrisGame.repeat_delay * 1000))
+
+    def update(self):
+        '''Handles input, actions are predicted locally and sent'''
+        for event in pygame.event.get():
+            if event.type == QUIT:
+                self.running = False
+            elif event.type == KEYDOWN:
+                action = self.key_actions.get(event.key)
+                if action is not None:
+                    self.client.send_action(action)
+        if self.client.model is not None:
+            self.score.set(self.client.model.score)
+            self.opponent_score.set(self.client.opponent.score)
+
+    def draw(self):
+        '''Draws both boards on screen,
+        returns list of changed rectangles of screen'''
+        if self.full_redraw:
+            self.full_redraw = False
+            self.grid.invalidate()
+            self.opponent_grid.invalidate()
+            dirty = [self.screen.blit(self.background, (0, 0))]
+        else:
+            dirty = [self.screen.blit(self.background, rect, rect)
+                     for rect in self.hud_rects]
+        self.hud_rects = [self.score.draw(self.screen),
+                          self.opponent_score.draw(self.screen)]
+        dirty.extend(self.hud_rects)
+        for grid, model in ((self.grid, self.client.model),
+                            (self.opponent_grid, self.client.opponent)):
+            grid.clear()
+            if model is not None:
+                model.draw()
+            dirty.extend(grid.draw(self.screen))
+        return dirty
+
+    async def run(self, host, port):
+        '''Plays on server until window is closed or server disconnects'''
+        await self.client.connect(host, port)
+        receiving = asyncio.ensure_future(self.client.receive())
+        try:
+            while self.running and not receiving.done():
+                self.update()
+                pygame.display.update(self.draw())
+                await self.client.writer.drain()
+                await asyncio.sleep(1 / 60)
+        finally:
+            receiving.cancel()
+            self.client.close()
+
+
+async def play_versus_bot(screen):
+    '''Plays against bot client on local server'''
+    import versus
+    server = versus.VersusServer()
+    await server.start()
+    bot = versus.BotClient()
+    await bot.connect("127.0.0.1", server.port)
+    bot_task = asyncio.ensure_future(bot.play())
+    try:
+        await VersusGame(screen).run("127.0.0.1", server.port)
+    finally:
+        bot.close()
+        bot_task.cancel()
+        await server.close()
+
+
+def versus_main(argv):
+    '''Command line entry point of "tetris.py versus"'''
+    import versus
+    parser = argparse.ArgumentParser(
+        prog="tetris.py versus",
+        description="Head-to-head tetris, plays against local bot "
+        "unless --connect, --serve or --bot is given")
+    parser.add_argument("--connect", action="store_true",
+                        help="play on server at --host and --port")
+    parser.add_argument("--serve", action="store_true",
+                        help="run server only")
+    parser.add_argument("--bot", action="store_true",
+                        help="connect bot client to server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7777)
+    args = parser.parse_args(argv)
+    if args.serve:
+        asyncio.run(versus.serve(args.host, args.port))
+        return
+    if args.bot:
+        asyncio.run(versus.run_bot(args.host, args.port))
+        return
+    pygame.init()
+    screen = pygame.display.set_mode((650, 350))
+    pygame.display.set_caption("Tetris versus")
+    if args.connect:
+        asyncio.run(VersusGame(screen).run(args.host, args.port))
+    else:
+        asyncio.run(play_versus_bot(screen))
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog="tetris.py", epilog="Use \"tetris.py tournament --help\" "
+        "for headless bot tournaments, \"tetris.py multi --help\" for "
+        "many boards played by bots or replays, \"tetris.py versus "
+        "--help\" for head-to-head games")
+    parser.add_argument("--record", metavar="FILE",
+                        help="record session to replay file")
+    parser.add_argument("--replay", metavar="FILE",
+                        help="play replay from replay or archive file")
+    parser.add_argument("--replay-index", type=int, default=0,
+                        help="index of replay in archive file")
+    parser.add_argument("--headless", action="store_true",
+                        help="play replay without rendering at full speed")
+    parser.add_argument("--profile-log", metavar="FILE",
+                        help="write JSON lines of frame phase times "
+                        "while profiler (F3) is on")
+    parser.add_argument("--rewind-seconds", type=float, default=10.0,
+                        help="game time kept for rewinding with Backspace")
+    parser.add_argument("--rewind-interval", type=float, default=0.1,
+                        help="game time between rewind snapshots")
+    parser.add_argument("--rewind-memory", type=int, metavar="BYTES",
+                        help="memory budget of rewind snapshots")
+    return parser.parse_args(argv)
 
 
 def main():
+    if sys.argv[1:2] == ["tournament"]:
+        import tournament
+        tournament.main("tetris", sys.argv[2:])
+        return
+    if sys.argv[1:2] == ["versus"]:
+        versus_main(sys.argv[2:])
+        return
+    if sys.argv[1:2] == ["multi"]:
+        import multiboard
+        multiboard.main("tetris", sys.argv[2:])
+        return
+    args = parse_args(sys.argv[1:])
+    if args.replay and args.headless:
+        import replay
+        replay.main("tetris", args)
+        return
+    recorder = None
+    replay = None
+    if args.replay:
+        replay = ReplayArchive(args.replay)[args.replay_index]
+    elif args.record:
+        recorder = ReplayWriter(args.record, "tetris",
+                                TetrisGame.grid_size, new_seed())
     pygame.init()
     screen = pygame.display.set_mode((650, 350))
     pygame.display.set_caption("Tetris")
-    game = TetrisGame(screen)
+    game = TetrisGame(screen, recorder, replay, args.profile_log)
+    game.rewind_seconds = args.rewind_seconds
+    game.rewind_interval = args.rewind_interval
+    game.rewind_max_bytes = args.rewind_memory
     clock = pygame.time.Clock()
 
     while game.running:
         clock.tick(60)
         game.update()
-        game.draw()
-        pygame.display.flip()
+        pygame.display.update(game.draw())
+        game.end_frame()
+    if game.profiler is not None:
+        game.profiler.close()
+    if recorder is not None:
+        recorder.close()
 
 
 if __name__ == "__main__":
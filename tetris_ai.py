@@ -0,0 +1,244 @@
+'''Tetris placement search and autoplayer, does not depend on pygame
+
+Board is searched as list of row bitmasks (see BitboardTetrisModel),
+placement is (rotation, column) reachable from the spawn position by
+rotating in place, moving sideways and dropping straight down.
+'''
+import weakref
+from collections import OrderedDict, namedtuple
+
+from tetris_core import _PIECES
+
+Features = namedtuple("Features", ["aggregate_height", "holes",
+                                   "bumpiness", "lines"])
+
+
+def default_evaluate(features):
+    '''Linear heuristic of resulting board, bigger is better'''
+    return (-0.510066 * features.aggregate_height +
+            0.760666 * features.lines -
+            0.35663 * features.holes -
+            0.184483 * features.bumpiness)
+
+
+def board_rows(model):
+    '''Returns list of row bitmasks of placed cells of TetrisModel'''
+    if hasattr(model, "rows"):
+        return list(model.rows)
+    width, height = model.grid_size
+    rows = [0] * height
+    for j, fill in enumerate(model.row_fill):
+        if fill:
+            for i in range(width):
+                if model.occupied((i, j)):
+                    rows[j] |= 1 << i
+    return rows
+
+
+def board_stats(rows, width):
+    '''Returns (heights, holes) of board computed from scratch'''
+    height = len(rows)
+    heights = [0] * width
+    holes = 0
+    for i in range(width):
+        bit = 1 << i
+        top = height
+        for j in range(height):
+            if rows[j] & bit:
+                if top == height:
+                    top = j
+            elif top < height:
+                holes += 1
+        heights[i] = height - top
+    return heights, holes
+
+
+def collides(rows, width, piece, x, y):
+    '''Checks collision of Piece at (x, y) with board rows'''
+    if x + piece.bbox[0] < 0 or x + piece.bbox[2] >= width:
+        return True
+    for j, mask in piece.row_masks:
+        row = y + j
+        if row < 0 or row >= len(rows):
+            return True
+        if rows[row] & (mask << x if x >= 0 else mask >> -x):
+            return True
+    return False
+
+
+class Board:
+    '''Board rows with column heights and hole count,
+    place() derives new Board updating statistics incrementally'''
+
+    def __init__(self, rows, width, heights=None, holes=None):
+        self.rows = rows
+        self.width = width
+        if heights is None:
+            heights, holes = board_stats(rows, width)
+        self.heights = heights
+        self.holes = holes
+
+    def key(self):
+        return tuple(self.rows)
+
+    def landing_row(self, piece_id, rotation, x):
+        '''Returns row where piece dropped straight down at column x lands'''
+        height = len(self.rows)
+        return min(height - self.heights[x + i] - bottom - 1
+                   for i, top, bottom, count
+                   in _PIECES[piece_id][rotation].columns)
+
+    def place(self, piece_id, rotation, x, y):
+        '''Returns (Board, lines) after placing piece at (x, y)
+        and removing full lines'''
+        piece = _PIECES[piece_id][rotation]
+        height = len(self.rows)
+        rows = self.rows[:]
+        for j, mask in piece.row_masks:
+            rows[y + j] |= mask << x if x >= 0 else mask >> -x
+        full_row = (1 << self.width) - 1
+        kept = [row for row in rows if row != full_row]
+        lines = height - len(kept)
+        if lines:
+            rows = [0] * lines + kept
+            return Board(rows, self.width), lines
+        heights = self.heights[:]
+        holes = self.holes
+        for i, top, bottom, count in piece.columns:
+            column = x + i
+            old_top = height - heights[column]
+            new_top = min(old_top, y + top)
+            holes += old_top - new_top - count
+            heights[column] = height - new_top
+        return Board(rows, self.width, heights, holes), 0
+
+    def features(self, lines):
+        heights = self.heights
+        bumpiness = sum(abs(heights[i] - heights[i + 1])
+                        for i in range(self.width - 1))
+        return Features(sum(heights), self.holes, bumpiness, lines)
+
+
+class Planner:
+    '''Searches best placement of current piece
+    self.evaluate: function of Features returning score of board
+    self.lookahead: also search placement of next piece
+    self.cache: LRU OrderedDict of best values of boards for next piece
+    '''
+
+    def __init__(self, evaluate=default_evaluate, lookahead=True,
+                 cache_size=4096):
+        self.evaluate = evaluate
+        self.lookahead = lookahead
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+
+    def placements(self, board, piece, pos):
+        '''Returns list of reachable (rotation, x, y) placements of piece
+        (piece_id, rotation) starting at pos'''
+        piece_id, rotation = piece
+        x0, y0 = pos
+        result = []
+        for turn in range(len(_PIECES[piece_id])):
+            if collides(board.rows, board.width,
+                        _PIECES[piece_id][rotation], x0, y0):
+                break
+            for step in (-1, 1):
+                x = x0 if step == -1 else x0 + 1
+                while not collides(board.rows, board.width,
+                                   _PIECES[piece_id][rotation], x, y0):
+                    y = board.landing_row(piece_id, rotation, x)
+                    if y >= y0:
+                        result.append((rotation, x, y))
+                    x += step
+            rotation = _PIECES[piece_id][rotation].next_rotation
+        return result
+
+    def _best_value(self, board, lines, piece):
+        '''Returns best value of boards after placing spawned piece,
+        lines are already cleared by previous piece,
+        uses transposition cache'''
+        key = (board.key(), lines, piece)
+        value = self.cache.get(key)
+        if value is not None:
+            self.cache.move_to_end(key)
+            return value
+        figure_width = _PIECES[piece[0]][piece[1]].size[0]
+        pos = ((board.width - figure_width) // 2, 0)
+        value = None
+        for rotation, x, y in self.placements(board, piece, pos):
+            new_board, new_lines = board.place(piece[0], rotation, x, y)
+            score = self.evaluate(new_board.features(lines + new_lines))
+            if value is None or score > value:
+                value = score
+        if value is None:
+            value = float("-inf")
+        self.cache[key] = value
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return value
+
+    def best_placement(self, model):
+        '''Returns best reachable (rotation, x) of current piece of model
+        or None if piece can not move'''
+        board = Board(board_rows(model), model.grid_size[0],
+                      list(model.column_heights), model.holes)
+        piece_id = model.current_piece[0]
+        best = None
+        best_score = None
+        for rotation, x, y in self.placements(board, model.current_piece,
+                                              model.current_figure_pos):
+            new_board, lines = board.place(piece_id, rotation, x, y)
+            if self.lookahead:
+                score = self._best_value(new_board, lines, model.next_piece)
+            else:
+                score = self.evaluate(new_board.features(lines))
+            if best_score is None or score > best_score:
+                best = (rotation, x)
+                best_score = score
+        return best
+
+    def plan_actions(self, model):
+        '''Returns list of TetrisEngine actions moving current piece of
+        model to the best placement'''
+        best = self.best_placement(model)
+        if best is None:
+            return []
+        rotation, x = best
+        piece_id, current = model.current_piece
+        actions = []
+        while current != rotation:
+            actions.append("rotate")
+            current = _PIECES[piece_id][current].next_rotation
+        dx = x - model.current_figure_pos[0]
+        actions.extend(["right" if dx > 0 else "left"] * abs(dx))
+        return actions
+
+
+class AutoPlayer:
+    '''Plays TetrisModel by planning every new piece with Planner,
+    gives one action per call'''
+
+    def __init__(self, planner=None):
+        self.planner = planner or Planner()
+        self.actions = []
+        self.pieces = None
+
+    def next_action(self, model):
+        if model.pieces != self.pieces:
+            self.pieces = model.pieces
+            self.actions = self.planner.plan_actions(model)
+        if self.actions:
+            return self.actions.pop(0)
+        return "drop"
+
+
+_players = weakref.WeakKeyDictionary()
+
+
+def policy(engine):
+    '''Tournament policy playing TetrisEngine with AutoPlayer'''
+    player = _players.get(engine)
+    if player is None:
+        player = _players[engine] = AutoPlayer()
+    return player.next_action(engine.model)
@@ -0,0 +1,163 @@
+'''Vectorized tetris environment running many boards at once,
+requires numpy, does not depend on pygame'''
+import numpy
+
+from tetris_core import _PIECES
+
+
+def _piece_arrays(pieces):
+    '''Converts _PIECES table to arrays indexed by [piece_id, rotation]:
+    cells: (column, row) offsets of 4 occupied cells
+    widths: width of figure 2d-array, used for spawn position
+    next_rotations: rotation index after rotation'''
+    cells = numpy.array([[piece.cells for piece in rotations]
+                         for rotations in pieces], numpy.int32)
+    widths = numpy.array([[piece.size[0] for piece in rotations]
+                          for rotations in pieces], numpy.int32)
+    next_rotations = numpy.array([[piece.next_rotation for piece in rotations]
+                                  for rotations in pieces], numpy.int32)
+    return cells, widths, next_rotations
+
+
+_CELLS, _WIDTHS, _NEXT_ROTATIONS = _piece_arrays(_PIECES)
+
+
+class BatchTetrisEnv:
+    '''N independent tetris boards advanced together by step(actions),
+    follows rules of TetrisModel/TetrisEngine, boards which game is over
+    are restarted automatically
+    self.boards: (N, height, width) bool array of placed cells
+    self.pieces, self.rotations: (N,) current piece of every board
+    self.next_pieces, self.next_rotations: (N,) next piece of every board
+    self.pos_x, self.pos_y: (N,) position of current piece
+    self.scores: (N,) score of current game of every board
+    self.lines: (N,) lines removed in current game of every board
+    actions: codes of TetrisEngine.actions and hard drop:
+        0 none, 1 left, 2 right, 3 rotate, 4 down, 5 drop
+    observation: (N, height, width) uint8 array,
+        0 empty cell, 1 placed cell, 2 cell of current piece
+    '''
+    NONE, LEFT, RIGHT, ROTATE, DOWN, DROP = range(6)
+
+    def __init__(self, n, size=(10, 20), seed=None):
+        self.n = n
+        self.width, self.height = size
+        self.rng = numpy.random.default_rng(seed)
+        self.index = numpy.arange(n)
+        self.boards = numpy.zeros((n, self.height, self.width), bool)
+        self.pieces = numpy.zeros(n, numpy.int32)
+        self.rotations = numpy.zeros(n, numpy.int32)
+        self.next_pieces = numpy.zeros(n, numpy.int32)
+        self.next_rotations = numpy.zeros(n, numpy.int32)
+        self.pos_x = numpy.zeros(n, numpy.int32)
+        self.pos_y = numpy.zeros(n, numpy.int32)
+        self.scores = numpy.zeros(n, numpy.int64)
+        self.lines = numpy.zeros(n, numpy.int64)
+        self.reset()
+
+    def _random_pieces(self, count):
+        return (self.rng.integers(0, len(_PIECES), count, numpy.int32),
+                self.rng.integers(0, 4, count, numpy.int32))
+
+    def _collides(self, boards, pieces, rotations, pos_x, pos_y):
+        '''Checks collision of pieces with boards (given by indices),
+        returns bool array'''
+        cells = _CELLS[pieces, rotations]
+        xs = cells[:, :, 0] + pos_x[:, None]
+        ys = cells[:, :, 1] + pos_y[:, None]
+        outside = (xs < 0) | (xs >= self.width) | (ys < 0) | (ys >= self.height)
+        placed = self.boards[boards[:, None],
+                             ys.clip(0, self.height - 1),
+                             xs.clip(0, self.width - 1)]
+        return (outside | placed).any(axis=1)
+
+    def _spawn(self, boards):
+        '''Replaces current pieces of boards with next,
+        returns bool array of boards where new piece does not fit'''
+        self.pieces[boards] = self.next_pieces[boards]
+        self.rotations[boards] = self.next_rotations[boards]
+        self.next_pieces[boards], self.next_rotations[boards] = \
+            self._random_pieces(len(boards))
+        self.pos_x[boards] = (self.width -
+                              _WIDTHS[self.pieces[boards],
+                                      self.rotations[boards]]) // 2
+        self.pos_y[boards] = 0
+        return self._collides(boards, self.pieces[boards],
+                              self.rotations[boards], self.pos_x[boards],
+                              self.pos_y[boards])
+
+    def _restart(self, boards):
+        '''Starts new games on boards'''
+        self.boards[boards] = False
+        self.scores[boards] = 0
+        self.lines[boards] = 0
+        self.next_pieces[boards], self.next_rotations[boards] = \
+            self._random_pieces(len(boards))
+        self._spawn(boards)
+
+    def _move(self, boards, dx, dy, rotate=False):
+        '''Moves pieces of boards where move is possible,
+        returns bool array of moved boards'''
+        rotations = self.rotations[boards]
+        if rotate:
+            rotations = _NEXT_ROTATIONS[self.pieces[boards], rotations]
+        pos_x = self.pos_x[boards] + dx
+        pos_y = self.pos_y[boards] + dy
+        free = ~self._collides(boards, self.pieces[boards], rotations,
+                               pos_x, pos_y)
+        moved = boards[free]
+        self.rotations[moved] = rotations[free]
+        self.pos_x[moved] = pos_x[free]
+        self.pos_y[moved] = pos_y[free]
+        return free
+
+    def reset(self):
+        '''Restarts all boards, returns observation'''
+        self._restart(self.index)
+        return self.observation()
+
+    def observation(self):
+        '''Returns (N, height, width) uint8 array of boards'''
+        obs = self.boards.astype(numpy.uint8)
+        cells = _CELLS[self.pieces, self.rotations]
+        obs[self.index[:, None], cells[:, :, 1] + self.pos_y[:, None],
+            cells[:, :, 0] + self.pos_x[:, None]] = 2
+        return obs
+
+    def step(self, actions):
+        '''Applies actions (array of N action codes) and makes one turn
+        on every board, returns (observation, rewards, dones)'''
+        actions = numpy.asarray(actions)
+        for code, dx, dy in ((self.LEFT, -1, 0), (self.RIGHT, 1, 0),
+                             (self.DOWN, 0, 1)):
+            self._move(self.index[actions == code], dx, dy)
+        self._move(self.index[actions == self.ROTATE], 0, 0, rotate=True)
+        dropping = self.index[actions == self.DROP]
+        while len(dropping):
+            dropping = dropping[self._move(dropping, 0, 1)]
+
+        # gravity: pieces which can not fall are placed
+        locked = self.index[~self._move(self.index, 0, 1)]
+        cells = _CELLS[self.pieces[locked], self.rotations[locked]]
+        self.boards[locked[:, None],
+                    cells[:, :, 1] + self.pos_y[locked, None],
+                    cells[:, :, 0] + self.pos_x[locked, None]] = True
+
+        # remove full lines: full rows are sorted to the top and cleared
+        full = self.boards.all(axis=2)
+        removed = full.sum(axis=1)
+        if removed.any():
+            order = numpy.argsort(~full, axis=1, kind="stable")
+            self.boards = numpy.take_along_axis(
+                self.boards, order[:, :, None], axis=1)
+            self.boards &= (numpy.arange(self.height)[None, :] >=
+                            removed[:, None])[:, :, None]
+        rewards = removed * (removed + 1) * 50
+        self.scores += rewards
+        self.lines += removed
+
+        dones = numpy.zeros(self.n, bool)
+        dones[locked] = self._spawn(locked)
+        if dones.any():
+            self._restart(self.index[dones])
+        return self.observation(), rewards, dones
@@ -0,0 +1,694 @@
+'''Tetris game model and headless engine, does not depend on pygame'''
+import random
+import time
+from collections import namedtuple
+
+from scheduler import FixedTimestep, VirtualClock
+
+_FIGURES_unproc = [
+    [
+        ["X", "X"],
+        ["X", "X"]
+    ],
+    [
+        [" ", "X", " "],
+        ["X", "X", "X"],
+        [" ", " ", " "]],
+    [
+        ["X", " ", " "],
+        ["X", "X", " "],
+        [" ", "X", " "]
+    ],
+    [
+        [" ", " ", "X", " "],
+        [" ", " ", "X", " "],
+        [" ", " ", "X", " "],
+        [" ", " ", "X", " "]
+    ],
+    [
+        ["X", " ", " "],
+        ["X", "X", "X"],
+        [" ", " ", " "]
+    ]
+]
+
+
+def rotate_figure(figure):
+    '''Returns rotated figure, presented as 2d-array'''
+    n = len(figure)
+    m = len(figure[0])
+    r_figure = [[" " for i in range(n)] for j in range(m)]
+    for i in range(n):
+        for j in range(m):
+            r_figure[j][i] = figure[i][m - 1 - j]
+    return r_figure
+
+
+def preprocess_figures(figures_unproc):
+    '''Converts an array of figures to an array of arrays of length 4
+    of all rotations of corresponding figures'''
+    def all_rotations(figure):
+        f_rot = []
+        for j in range(0, 4):
+            f_rot.append(figure)
+            figure = rotate_figure(figure)
+        return f_rot
+
+    figures = list(map(all_rotations, figures_unproc))
+    return figures
+
+
+_FIGURES = preprocess_figures(_FIGURES_unproc)
+
+
+Piece = namedtuple("Piece", ["figure", "cells", "size", "bbox",
+                             "row_masks", "columns", "next_rotation"])
+
+
+def preprocess_pieces(figures):
+    '''Converts an array of arrays of figure rotations to the table of
+    Piece tuples, _PIECES[piece_id][rotation] contains:
+        figure: 2d-array of rotation in FIGURE format
+        cells: tuple of (column, row) offsets of occupied cells
+        size: (width, height) of figure 2d-array
+        bbox: (left, top, right, bottom) offsets of occupied cells
+        row_masks: tuple of (row, bitmask) pairs of non-empty rows
+        columns: tuple of (column, top, bottom, count) of non-empty
+            columns, top and bottom are offsets of extreme cells
+        next_rotation: rotation index after rotation_move'''
+    def make_piece(rotations, rot_i):
+        figure = rotations[rot_i]
+        cells = tuple((i, j) for j in range(len(figure[0]))
+                      for i in range(len(figure)) if figure[i][j] != " ")
+        columns = [i for i, j in cells]
+        rows = [j for i, j in cells]
+        row_masks = []
+        for j in sorted(set(rows)):
+            mask = 0
+            for i, cell_j in cells:
+                if cell_j == j:
+                    mask |= 1 << i
+            row_masks.append((j, mask))
+        profiles = []
+        for i in sorted(set(columns)):
+            column_rows = [j for cell_i, j in cells if cell_i == i]
+            profiles.append((i, min(column_rows), max(column_rows),
+                             len(column_rows)))
+        return Piece(figure, cells, (len(figure), len(figure[0])),
+                     (min(columns), min(rows), max(columns), max(rows)),
+                     tuple(row_masks), tuple(profiles),
+                     (rot_i + 1) % len(rotations))
+
+    return [[make_piece(rotations, rot_i) for rot_i in range(len(rotations))]
+            for rotations in figures]
+
+
+_PIECES = preprocess_pieces(_FIGURES)
+
+
+class TetrisGameOver(Exception):
+    pass
+
+
+class TetrisModel:
+    '''Model of tetris game
+    self.grid: rectangular grid of playing field, Grid object,
+        None for headless model
+    self.random: random.Random generator of pieces
+    self.placed_cells: 2-d array of placed pieces of figures,
+        element is pygame Color of the cell
+    self.grid_size: dimensions of self.placed_cells
+    format of piece: (piece_id, rotation) indices of _PIECES table
+    self.next_piece: piece to appear
+    self.current_piece: piece currently playing
+    self.next_figure, self.current_figure: 2d-arrays of corresponding
+        pieces in FIGURE format
+    self.current_figure_pos position of figure on a field
+    self.score: players score
+    self.lines: number of removed lines in current round
+    self.pieces: number of placed pieces in current round
+    self.cleared_lines: lines removed after the last placed piece
+        (numbered before removal)
+    self.scheduler: FixedTimestep producing turns every self.move_delay
+    self.column_heights, self.holes, self.row_fill: read-only board
+        statistics, maintained incrementally on placing and removing
+    self.board_version: number of changes of placed cells, observers
+        compare it to skip unchanged board
+    self.status: status of the game:
+        "game_active" for running game
+        "game_over" for ended game
+    '''
+    cell_color = "#FF00FF"
+    ghost_color = "#C0A0C0"
+    garbage_color = "#707070"
+    show_ghost = True
+    move_delay = 0.250
+
+    def __init__(self, grid=None, size=None, seed=None, clock=time.monotonic):
+        '''grid: Grid to draw on, gives size of playing field
+        size: (width, height) of playing field if grid is not given
+        seed: seed of pieces generator
+        clock: time source of self.scheduler'''
+        self.grid = grid
+        self.grid_size = size if size else grid.size
+        self.random = random.Random(seed)
+        self.scheduler = FixedTimestep(self.move_delay, clock)
+        self.board_version = 0
+        self._saved_board = (None, None)
+        self._saved_random = None
+        self.reinit_round()
+
+    def reinit_round(self):
+        '''Reinitilizes game after start or gameover'''
+        self.next_piece = self.random_piece()
+        self.reset_board()
+        self.reset_stats()
+        self.take_next_figure()
+        self.score = 0
+        self.lines = 0
+        self.pieces = 0
+        self.cleared_lines = []
+        self.scheduler.reset()
+        self.pause_status = False
+        self.status = "game_active"
+
+    def snapshot(self):
+        '''Returns immutable snapshot of game state for restore(),
+        board and random generator state are shared with previous
+        snapshots while they do not change'''
+        version, board = self._saved_board
+        if version != self.board_version:
+            board = self.save_board()
+            self._saved_board = (self.board_version, board)
+        if self._saved_random is None:
+            self._saved_random = self.random.getstate()
+        return (board, self._saved_random, self.current_piece,
+                self.current_figure_pos, self.next_piece, self.score,
+                self.lines, self.pieces, self.status)
+
+    def restore(self, snapshot):
+        '''Returns game to the state of snapshot()'''
+        (board, random_state, self.current_piece, self.current_figure_pos,
+         self.next_piece, self.score, self.lines, self.pieces,
+         self.status) = snapshot
+        self.load_board(board)
+        self.recount_stats()
+        self._saved_board = (self.board_version, board)
+        self.random.setstate(random_state)
+        self._saved_random = random_state
+        self.cleared_lines = []
+        self.scheduler.reset()
+
+    def save_board(self):
+        '''Returns placed cells as tuple of column tuples'''
+        return tuple(map(tuple, self.placed_cells))
+
+    def load_board(self, board):
+        '''Replaces placed cells by save_board() result'''
+        self.placed_cells = list(map(list, board))
+
+    def reset_board(self):
+        '''Removes all placed cells'''
+        self.placed_cells = [
+            [None for y in range(self.grid_size[1])]
+            for x in range(self.grid_size[0])]
+
+    def reset_stats(self):
+        '''Initializes board statistics of empty board'''
+        self._heights = [0] * self.grid_size[0]
+        self._holes = 0
+        self._row_fill = [0] * self.grid_size[1]
+        self.board_version += 1
+
+    def recount_stats(self):
+        '''Computes board statistics from placed cells,
+        should be called after placed cells are replaced directly'''
+        width, height = self.grid_size
+        self.reset_stats()
+        for i in range(width):
+            top = height
+            for j in range(height):
+                if self.occupied((i, j)):
+                    self._row_fill[j] += 1
+                    top = min(top, j)
+                elif top < height:
+                    self._holes += 1
+            self._heights[i] = height - top
+
+    @property
+    def column_heights(self):
+        '''Tuple of heights of topmost placed cells of columns'''
+        return tuple(self._heights)
+
+    @property
+    def holes(self):
+        '''Number of empty cells below topmost placed cells of columns'''
+        return self._holes
+
+    @property
+    def row_fill(self):
+        '''Tuple of numbers of placed cells in rows'''
+        return tuple(self._row_fill)
+
+    @property
+    def stack_height(self):
+        '''Height of the highest column'''
+        return max(self._heights)
+
+    def pause_toggle(self):
+        '''Sets game on pause'''
+        self.pause_status = not self.pause_status
+        self.scheduler.reset()
+
+    @property
+    def current_figure(self):
+        return _PIECES[self.current_piece[0]][self.current_piece[1]].figure
+
+    @property
+    def next_figure(self):
+        return _PIECES[self.next_piece[0]][self.next_piece[1]].figure
+
+    def random_piece(self):
+        '''Returns random tetris piece'''
+        self._saved_random = None
+        fig_i = self.random.randint(0, len(_PIECES) - 1)
+        rot_i = self.random.randint(0, 4 - 1)
+        return (fig_i, rot_i)
+
+    def take_next_figure(self):
+        '''Replaces current playing figure with next'''
+        next_piece = self.random_piece()
+        figure_pos = (
+            (self.grid_size[0] -
+             _PIECES[self.next_piece[0]][self.next_piece[1]].size[0]) // 2, 0)
+        if self.collides(self.next_piece, figure_pos):
+            raise TetrisGameOver
+        self.current_piece = self.next_piece
+        self.next_piece = next_piece
+        self.current_figure_pos = figure_pos
+
+    def rotation_move(self):
+        '''Rotates current playing figure'''
+        piece_id, rotation = self.current_piece
+        new_piece = (piece_id, _PIECES[piece_id][rotation].next_rotation)
+        if self.collides(new_piece, self.current_figure_pos):
+            return False
+        else:
+            self.current_piece = new_piece
+            return True
+
+    def collides(self, piece, pos):
+        '''Checks collision of `piece` at `pos` with the occupied cells'''
+        x, y = pos
+        width, height = self.grid_size
+        for i, j in _PIECES[piece[0]][piece[1]].cells:
+            i += x
+            j += y
+            if i < 0 or i >= width or j < 0 or j >= height or \
+                    self.placed_cells[i][j]:
+                return True
+        return False
+
+    def occupied(self, pos):
+        '''Checks if cell at `pos` is placed'''
+        return self.placed_cells[pos[0]][pos[1]] is not None
+
+    def get_full_lines(self, rows):
+        '''Returns list of completely filled lines among `rows`'''
+        width = self.grid_size[0]
+        return [j for j in rows if self._row_fill[j] == width]
+
+    def remove_lines(self, lines):
+        '''Removes sorted `lines` in one sweep,
+        lines above them are shifted down'''
+        lowest = lines[-1]
+        for column in self.placed_cells:
+            kept = [column[j] for j in range(lowest) if j not in lines]
+            column[:lowest + 1] = [None] * len(lines) + kept
+
+    def remove_full_lines(self, rows=None):
+        '''Removes filled lines among `rows` (all by default) and updates
+        score, returns list of removed lines'''
+        if rows is None:
+            rows = range(self.grid_size[1])
+        full_lines = self.get_full_lines(rows)
+        if full_lines:
+            self.remove_lines(full_lines)
+            self.remove_lines_stats(full_lines)
+        self.score += len(full_lines) * (len(full_lines) + 1) * 50
+        self.lines += len(full_lines)
+        self.cleared_lines = full_lines
+        return full_lines
+
+    def remove_lines_stats(self, lines):
+        '''Updates board statistics after removal of sorted full `lines`:
+        columns keep holes and lower by len(lines), except columns topped
+        at the highest removed line, which are rescanned'''
+        height = self.grid_size[1]
+        removed = len(lines)
+        lowest = lines[-1]
+        self.board_version += 1
+        self._row_fill[:lowest + 1] = [0] * removed + \
+            [fill for j, fill in enumerate(self._row_fill[:lowest])
+             if j not in lines]
+        for i, column_height in enumerate(self._heights):
+            old_top = height - column_height
+            if old_top < lines[0]:
+                self._heights[i] = column_height - removed
+                continue
+            top = old_top + removed
+            while top < height and not self.occupied((i, top)):
+                top += 1
+            self._heights[i] = height - top
+            self._holes -= top - removed - old_top
+
+    def add_garbage(self, count, hole):
+        '''Pushes placed cells up by `count` rows of garbage filled except
+        column `hole`, returns False if it tops out the game'''
+        width, height = self.grid_size
+        count = min(count, height)
+        topped_out = any(self._row_fill[:count])
+        self.push_garbage_rows(count, hole)
+        self._row_fill[:] = self._row_fill[count:] + [width - 1] * count
+        self.board_version += 1
+        for i, column_height in enumerate(self._heights):
+            if i != hole:
+                self._heights[i] = min(height, column_height + count)
+            elif column_height:
+                self._heights[i] = column_height + count
+                self._holes += count
+        # current figure is pushed up together with the placed cells
+        x, y = self.current_figure_pos
+        for lift in range(count + 1):
+            if not self.collides(self.current_piece, (x, y - lift)):
+                self.current_figure_pos = (x, y - lift)
+                break
+        else:
+            topped_out = True
+        if topped_out:
+            self.status = "game_over"
+            return False
+        return True
+
+    def push_garbage_rows(self, count, hole):
+        '''Shifts placed cells up and adds garbage rows at the bottom'''
+        for i, column in enumerate(self.placed_cells):
+            cell = None if i == hole else self.garbage_color
+            column[:] = column[count:] + [cell] * count
+
+    def place_stats(self, piece, pos):
+        '''Updates board statistics after placing `piece` at `pos`'''
+        x, y = pos
+        piece = _PIECES[piece[0]][piece[1]]
+        height = self.grid_size[1]
+        self.board_version += 1
+        for i, j in piece.cells:
+            self._row_fill[y + j] += 1
+        for i, top, bottom, count in piece.columns:
+            old_top = height - self._heights[x + i]
+            new_top = min(old_top, y + top)
+            self._holes += old_top - new_top - count
+            self._heights[x + i] = height - new_top
+
+    def place_piece(self, piece, pos):
+        '''Adds cells of `piece` at `pos` to placed cells'''
+        x, y = pos
+        for i, j in _PIECES[piece[0]][piece[1]].cells:
+            self.placed_cells[x + i][y + j] = self.cell_color
+        self.place_stats(piece, pos)
+
+    def make_next_step(self):
+        '''Proceed to next step of turn-based game'''
+        if not self.move_figure((0, 1)):
+            piece = _PIECES[self.current_piece[0]][self.current_piece[1]]
+            y = self.current_figure_pos[1]
+            self.place_piece(self.current_piece, self.current_figure_pos)
+            self.pieces += 1
+            self.remove_full_lines(
+                range(y + piece.bbox[1], y + piece.bbox[3] + 1))
+            self.take_next_figure()
+
+    def move_figure(self, dir):
+        '''Moves current playing figure in direction'''
+        new_pos = (self.current_figure_pos[0] + dir[0],
+                   self.current_figure_pos[1] + dir[1])
+        if self.collides(self.current_piece, new_pos):
+            return False
+        else:
+            self.current_figure_pos = new_pos
+            return True
+
+    def landing_row(self, piece=None, pos=None):
+        '''Returns row where `piece` (current by default) lands if dropped
+        from `pos`, computed from column heights unless the piece is
+        already below the top of some of its columns'''
+        if piece is None:
+            piece, pos = self.current_piece, self.current_figure_pos
+        x, y = pos
+        height = self.grid_size[1]
+        landing = min(height - self._heights[x + i] - bottom - 1
+                      for i, top, bottom, count
+                      in _PIECES[piece[0]][piece[1]].columns)
+        if landing >= y:
+            return landing
+        while not self.collides(piece, (x, y + 1)):
+            y += 1
+        return y
+
+    def hard_drop(self):
+        '''Moves current playing figure down to its landing row,
+        figure is placed on the next turn'''
+        y = self.landing_row()
+        moved = y != self.current_figure_pos[1]
+        self.current_figure_pos = (self.current_figure_pos[0], y)
+        return moved
+
+    def apply_action(self, action):
+        '''Applies player's action (one of TetrisEngine.actions),
+        returns True if piece has moved'''
+        if action is None:
+            return False
+        if action == "left":
+            return self.move_figure((-1, 0))
+        if action == "right":
+            return self.move_figure((1, 0))
+        if action == "rotate":
+            return self.rotation_move()
+        if action == "down":
+            return self.move_figure((0, 1))
+        if action == "drop":
+            return self.hard_drop()
+        raise ValueError("Unknown tetris action: " + str(action))
+
+    def tick(self):
+        '''Makes one turn of the game, returns False on game over'''
+        try:
+            self.make_next_step()
+        except TetrisGameOver:
+            self.status = "game_over"
+            return False
+        return True
+
+    def ticks_due(self):
+        '''Returns number of turns due according to self.scheduler'''
+        if self.status != "game_active" or self.pause_status:
+            return 0
+        return self.scheduler.advance()
+
+    def propagate(self):
+        '''Continue process game, should be called on each frame.abs
+        Handles time, gamestatuses and calls model update
+        Returns number of turns made'''
+        if self.status == "game_over":
+            self.reinit_round()
+            return 0
+        ticks = self.ticks_due()
+        for made in range(ticks):
+            if not self.tick():
+                return made + 1
+        return ticks
+
+    def draw_placed_cells(self):
+        '''Draws placed cells on grid'''
+        for i in range(self.grid_size[0]):
+            for j in range(self.grid_size[1]):
+                if(self.placed_cells[i][j] is not None):
+                    self.grid.set_cell_state((i, j), self.placed_cells[i][j])
+
+    def draw(self):
+        '''Draws game objects on grid'''
+        self.draw_placed_cells()
+        x, y = self.current_figure_pos
+        cells = _PIECES[self.current_piece[0]][self.current_piece[1]].cells
+        if self.show_ghost:
+            ghost_y = self.landing_row()
+            for i, j in cells:
+                self.grid.set_cell_state((x + i, ghost_y + j),
+                                         self.ghost_color)
+        for i, j in cells:
+            self.grid.set_cell_state((x + i, y + j), self.cell_color)
+
+
+class BitboardTetrisModel(TetrisModel):
+    '''TetrisModel storing placed cells as row bitmasks,
+    has the same interface as TetrisModel
+    self.rows: list of bitmasks of placed cells,
+        bit i of self.rows[j] is set if cell (i, j) is occupied
+    self.row_colors: list of rows of colors of placed cells
+    self.full_row: bitmask of completely filled row
+    self.placed_cells: column-major copy of self.row_colors,
+        built on every access
+    '''
+
+    def reset_board(self):
+        '''Removes all placed cells'''
+        width, height = self.grid_size
+        self.full_row = (1 << width) - 1
+        self.rows = [0] * height
+        self.row_colors = [[None] * width for j in range(height)]
+
+    @property
+    def placed_cells(self):
+        return [[self.row_colors[j][i] for j in range(self.grid_size[1])]
+                for i in range(self.grid_size[0])]
+
+    def save_board(self):
+        '''Returns (rows, row colors) as tuples'''
+        return (tuple(self.rows), tuple(map(tuple, self.row_colors)))
+
+    def load_board(self, board):
+        '''Replaces placed cells by save_board() result'''
+        rows, row_colors = board
+        self.rows[:] = rows
+        self.row_colors[:] = map(list, row_colors)
+
+    def collides(self, piece, pos):
+        '''Checks collision of `piece` at `pos` with the occupied cells'''
+        x, y = pos
+        piece = _PIECES[piece[0]][piece[1]]
+        if x + piece.bbox[0] < 0 or x + piece.bbox[2] >= self.grid_size[0]:
+            return True
+        for j, mask in piece.row_masks:
+            row = y + j
+            if row < 0 or row >= self.grid_size[1]:
+                return True
+            if self.rows[row] & (mask << x if x >= 0 else mask >> -x):
+                return True
+        return False
+
+    def occupied(self, pos):
+        '''Checks if cell at `pos` is placed'''
+        return self.rows[pos[1]] >> pos[0] & 1 == 1
+
+    def get_full_lines(self, rows):
+        '''Returns list of completely filled lines among `rows`'''
+        return [j for j in rows if self.rows[j] == self.full_row]
+
+    def remove_lines(self, lines):
+        '''Removes sorted `lines` in one sweep,
+        lines above them are shifted down'''
+        lowest = lines[-1]
+        self.rows[:lowest + 1] = [0] * len(lines) + \
+            [row for j, row in enumerate(self.rows[:lowest]) if j not in lines]
+        self.row_colors[:lowest + 1] = \
+            [[None] * self.grid_size[0] for j in lines] + \
+            [colors for j, colors in enumerate(self.row_colors[:lowest])
+             if j not in lines]
+
+    def place_piece(self, piece, pos):
+        '''Adds cells of `piece` at `pos` to placed cells'''
+        x, y = pos
+        for i, j in _PIECES[piece[0]][piece[1]].cells:
+            self.rows[y + j] |= 1 << (x + i)
+            self.row_colors[y + j][x + i] = self.cell_color
+        self.place_stats(piece, pos)
+
+    def push_garbage_rows(self, count, hole):
+        '''Shifts placed cells up and adds garbage rows at the bottom'''
+        width = self.grid_size[0]
+        colors = [self.garbage_color] * width
+        colors[hole] = None
+        self.rows[:] = self.rows[count:] + \
+            [self.full_row & ~(1 << hole)] * count
+        self.row_colors[:] = self.row_colors[count:] + \
+            [colors[:] for j in range(count)]
+
+    def draw_placed_cells(self):
+        '''Draws placed cells on grid'''
+        for j, row in enumerate(self.rows):
+            if row:
+                colors = self.row_colors[j]
+                for i in range(self.grid_size[0]):
+                    if row >> i & 1:
+                        self.grid.set_cell_state((i, j), colors[i])
+
+
+class TetrisEngine:
+    '''Headless tetris simulation advanced by explicit steps,
+    reads no clock and does not need pygame
+    self.model: TetrisModel (or subclass) without grid
+    self.steps: number of turns made since reset
+    self.done: True after game over, reset() starts new game
+    self.observation: observation.TetrisObservation made by observe()
+        or None
+    actions: None, "left", "right", "rotate", "down", "drop"
+    '''
+    actions = (None, "left", "right", "rotate", "down", "drop")
+
+    def __init__(self, size=(10, 20), seed=None, model_class=TetrisModel):
+        self.size = size
+        self.model_class = model_class
+        self.observation = None
+        self.reset(seed)
+
+    def reset(self, seed=None):
+        '''Starts new game with pieces generated from seed'''
+        self.model = self.model_class(size=self.size, seed=seed,
+                                      clock=VirtualClock())
+        self.steps = 0
+        self.done = False
+        if self.observation is not None:
+            self.observation.attach(self.model)
+            self.observation.update()
+
+    def observe(self, frames=1):
+        '''Returns observation.TetrisObservation of the game kept up to
+        date by reset() and tick(), actions applied by apply() show up
+        after the next tick()'''
+        from observation import TetrisObservation
+        self.observation = TetrisObservation(self.model, frames)
+        self.observation.update()
+        return self.observation
+
+    def apply(self, action):
+        '''Applies player's action without advancing the game,
+        returns True if piece has moved'''
+        if self.done:
+            return False
+        return self.model.apply_action(action)
+
+    def tick(self):
+        '''Makes one turn of the game, returns (reward, done)'''
+        if self.done:
+            return 0, True
+        score = self.model.score
+        self.steps += 1
+        self.done = not self.model.tick()
+        if self.observation is not None:
+            self.observation.update()
+        return self.model.score - score, self.done
+
+    def step(self, action):
+        '''Applies action and makes one turn, returns (reward, done)'''
+        self.apply(action)
+        return self.tick()
+
+    def results(self):
+        '''Returns dict of current game results'''
+        return {"score": self.model.score, "lines": self.model.lines,
+                "pieces": self.model.pieces, "steps": self.steps}
+
+
+def random_policy(engine):
+    '''Policy choosing random action, uses global random generator'''
+    return random.choice(engine.actions)
@@ -0,0 +1,204 @@
+'''Process-pool tournament runner for headless tetris and snake bots,
+does not depend on pygame'''
+import argparse
+import csv
+import importlib
+import json
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import snake_core
+import tetris_core
+
+ENGINES = {
+    "tetris": tetris_core.TetrisEngine,
+    "snake": snake_core.SnakeEngine,
+}
+
+DEFAULT_POLICIES = {
+    "tetris": "tetris_core:random_policy",
+    "snake": "snake_core:random_policy",
+}
+
+
+def load_policy(spec):
+    '''Imports policy callable given as "module:name",
+    policy is called with engine and returns action'''
+    module_name, _, name = spec.partition(":")
+    if not name:
+        raise ValueError("Policy should be given as module:name, got " + spec)
+    return getattr(importlib.import_module(module_name), name)
+
+
+def play_game(kind, policy, seed, size, max_steps):
+    '''Plays one game with policy callable, returns dict of results'''
+    random.seed(seed)
+    start = time.perf_counter()
+    engine = ENGINES[kind](size=size, seed=seed)
+    while not engine.done and engine.steps < max_steps:
+        engine.step(policy(engine))
+    results = engine.results()
+    results["game_over"] = engine.done
+    results["wall_time"] = round(time.perf_counter() - start, 6)
+    return results
+
+
+def run_chunk(kind, policy_spec, seeds, size, max_steps):
+    '''Plays games with all seeds, runs in worker process,
+    returns list of result rows'''
+    policy = load_policy(policy_spec)
+    rows = []
+    for seed in seeds:
+        row = {"policy": policy_spec, "seed": seed}
+        row.update(play_game(kind, policy, seed, size, max_steps))
+        rows.append(row)
+    return rows
+
+
+class ResultWriter:
+    '''Appends result rows to CSV (by .csv extension) or JSONL file,
+    rows are flushed as soon as they are written,
+    self.append: False to overwrite existing file on the first write'''
+
+    def __init__(self, path, append=True):
+        self.path = path
+        self.append = append
+        self.csv = path.endswith(".csv")
+        self.file = None
+        self.writer = None
+
+    def completed(self):
+        '''Returns set of (policy, seed) already present in file'''
+        done = set()
+        if not os.path.exists(self.path):
+            return done
+        self._drop_partial_row()
+        with open(self.path, newline="") as f:
+            if self.csv:
+                rows = csv.DictReader(f)
+            else:
+                rows = (self._parse(line) for line in f)
+            for row in rows:
+                if row and row.get("seed") not in (None, ""):
+                    done.add((row["policy"], int(row["seed"])))
+        return done
+
+    def _drop_partial_row(self):
+        '''Truncates file after its last newline, so that row cut by
+        interruption is neither read nor continued by appended rows'''
+        with open(self.path, "r+b") as f:
+            end = pos = f.seek(0, os.SEEK_END)
+            while pos > 0:
+                step = min(pos, 4096)
+                f.seek(pos - step)
+                newline = f.read(step).rfind(b"\n")
+                if newline >= 0:
+                    pos += newline + 1 - step
+                    break
+                pos -= step
+            if pos < end:
+                f.truncate(pos)
+
+    @staticmethod
+    def _parse(line):
+        '''Parses JSONL line, skips line truncated by interruption'''
+        try:
+            return json.loads(line)
+        except ValueError:
+            return None
+
+    def write(self, row):
+        if self.file is None:
+            if self.append and os.path.exists(self.path):
+                self._drop_partial_row()
+            new_file = not self.append or not os.path.exists(self.path) or \
+                os.path.getsize(self.path) == 0
+            self.file = open(self.path, "a" if self.append else "w",
+                             newline="")
+            if self.csv:
+                self.writer = csv.DictWriter(self.file, list(row))
+                if new_file:
+                    self.writer.writeheader()
+        if self.csv:
+            self.writer.writerow(row)
+        else:
+            self.file.write(json.dumps(row) + "\n")
+        self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+def run_tournament(kind, policies, games, output, seed=0, jobs=None,
+                   chunk_size=16, size=None, max_steps=100000, resume=True):
+    '''Plays `games` seeded games for every policy spec in process pool,
+    streams result rows to output, returns number of played games
+    seeds: seed, seed + 1, ..., seed + games - 1, same for every policy
+    resume: skip games already present in output, otherwise output
+        is overwritten'''
+    size = size or ENGINES[kind]().size
+    writer = ResultWriter(output, append=resume)
+    done = writer.completed() if resume else set()
+    tasks = []
+    for policy_spec in policies:
+        load_policy(policy_spec)
+        seeds = [s for s in range(seed, seed + games)
+                 if (policy_spec, s) not in done]
+        for i in range(0, len(seeds), chunk_size):
+            tasks.append((policy_spec, seeds[i:i + chunk_size]))
+
+    played = 0
+    executor = ProcessPoolExecutor(max_workers=jobs)
+    try:
+        futures = [executor.submit(run_chunk, kind, policy_spec, seeds,
+                                   size, max_steps)
+                   for policy_spec, seeds in tasks]
+        for future in as_completed(futures):
+            for row in future.result():
+                writer.write(row)
+                played += 1
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        writer.close()
+    return played
+
+
+def parse_size(text):
+    width, _, height = text.partition("x")
+    return (int(width), int(height))
+
+
+def main(kind, argv=None):
+    '''Command line entry point of "<kind>.py tournament"'''
+    parser = argparse.ArgumentParser(
+        prog=kind + ".py tournament",
+        description="Play seeded headless " + kind + " games with bots")
+    parser.add_argument("-p", "--policy", action="append", dest="policies",
+                        help="policy as module:callable, can be repeated "
+                        "(default " + DEFAULT_POLICIES[kind] + ")")
+    parser.add_argument("-n", "--games", type=int, default=100,
+                        help="games per policy")
+    parser.add_argument("-o", "--output", default=kind + "_results.jsonl",
+                        help="output .jsonl or .csv file")
+    parser.add_argument("-s", "--seed", type=int, default=0,
+                        help="seed of the first game")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="worker processes (default: all cores)")
+    parser.add_argument("--chunk-size", type=int, default=16,
+                        help="games per worker task")
+    parser.add_argument("--size", type=parse_size, default=None,
+                        help="field size as WIDTHxHEIGHT")
+    parser.add_argument("--max-steps", type=int, default=100000,
+                        help="steps limit of one game")
+    parser.add_argument("--no-resume", action="store_true",
+                        help="replay all games, overwriting output")
+    args = parser.parse_args(argv)
+    played = run_tournament(
+        kind, args.policies or [DEFAULT_POLICIES[kind]], args.games,
+        args.output, seed=args.seed, jobs=args.jobs,
+        chunk_size=args.chunk_size, size=args.size,
+        max_steps=args.max_steps, resume=not args.no_resume)
+    print("Played {} games, results in {}".format(played, args.output))
@@ -0,0 +1,408 @@
+'''Head-to-head tetris over asyncio streams, does not depend on pygame
+
+VersusServer hosts TetrisModel of both players and is the only authority
+on their games, clients send only actions and receive state deltas.
+Messages are JSON objects, one per line:
+    client -> server: {"seq": n, "a": action}
+    server -> client: {"round": n, "player": i, "size": [w, h]}
+                      {"t": tick, "ack": seq, "you": delta, "opp": delta}
+                      {"over": n, "winner": i}
+All messages of one server tick are sent together. Delta holds only
+fields of board state (see board_state) changed since the previous
+message, "rows" is list of [row, bitmask] pairs of changed rows.
+Lines removed at once attack the opponent with garbage lines (ATTACK).
+'''
+import asyncio
+import json
+import random
+import time
+
+import tetris_ai
+from scheduler import FixedTimestep, VirtualClock
+from tetris_core import BitboardTetrisModel, TetrisEngine, TetrisModel
+
+# garbage lines sent for number of lines removed by one piece
+ATTACK = (0, 0, 1, 2, 4)
+ACTIONS = frozenset(TetrisEngine.actions[1:])
+
+
+def encode(message):
+    return (json.dumps(message, separators=(",", ":")) + "\n").encode()
+
+
+def board_state(model):
+    '''Returns dict of model state sent to clients'''
+    return {
+        "rows": tetris_ai.board_rows(model),
+        "piece": list(model.current_piece) + list(model.current_figure_pos),
+        "next": list(model.next_piece),
+        "score": model.score,
+        "lines": model.lines,
+        "pieces": model.pieces,
+        "status": model.status,
+    }
+
+
+def state_delta(old, new):
+    '''Returns dict of fields of state `new` differing from `old`'''
+    if old is None:
+        old = {"rows": [None] * len(new["rows"])}
+    delta = {}
+    for key, value in new.items():
+        if key == "rows":
+            rows = [[j, row] for j, row in enumerate(value)
+                    if row != old["rows"][j]]
+            if rows:
+                delta["rows"] = rows
+        elif value != old.get(key):
+            delta[key] = value
+    return delta
+
+
+def apply_delta(state, delta, height):
+    '''Updates board state dict by delta, returns it'''
+    if state is None:
+        state = {"rows": [0] * height}
+    for key, value in delta.items():
+        if key == "rows":
+            for j, row in value:
+                state["rows"][j] = row
+        else:
+            state[key] = value
+    return state
+
+
+def load_state(model, state):
+    '''Replaces game state of BitboardTetrisModel by board state dict'''
+    width = model.grid_size[0]
+    if state["rows"] != model.rows:
+        model.rows[:] = state["rows"]
+        model.row_colors[:] = [
+            [model.cell_color if row >> i & 1 else None
+             for i in range(width)] for row in model.rows]
+        model.recount_stats()
+    piece_id, rotation, x, y = state["piece"]
+    model.current_piece = (piece_id, rotation)
+    model.current_figure_pos = (x, y)
+    model.next_piece = tuple(state["next"])
+    model.score = state["score"]
+    model.lines = state["lines"]
+    model.pieces = state["pieces"]
+    model.status = state["status"]
+
+
+class Player:
+    '''Connection of player to VersusServer
+    self.model: TetrisModel of player's game
+    self.inputs: list of (seq, action) received since the last tick
+    self.ack: seq of the last applied action
+    self.sent_ack: self.ack last sent to the player
+    self.garbage: garbage lines to add on the next tick
+    self.sent: board states of (own, opponent's) game last sent
+    '''
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.model = None
+        self.inputs = []
+        self.ack = 0
+        self.sent_ack = 0
+        self.garbage = 0
+        self.sent = (None, None)
+
+
+class VersusServer:
+    '''Authoritative two-player tetris server
+    self.players: list of connected Player, first two play
+    self.tick_rate: server ticks per second, inputs received during tick
+        are applied and results sent at its end
+    self.round: number of current round, 0 before the first one
+    self.wins: list of numbers of won rounds of players
+    '''
+    tick_rate = 30
+    size = (10, 20)
+
+    def __init__(self, host="127.0.0.1", port=0, seed=None,
+                 model_class=TetrisModel, clock=time.monotonic):
+        self.host = host
+        self.port = port
+        self.random = random.Random(seed)
+        self.model_class = model_class
+        self.clock = clock
+        self.players = []
+        self.round = 0
+        self.wins = [0, 0]
+        self.tick = 0
+        self.server = None
+        self.task = None
+
+    async def start(self):
+        '''Starts listening, self.port is set to the actual port'''
+        self.server = await asyncio.start_server(self.handle, self.host,
+                                                 self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.task = asyncio.ensure_future(self.run())
+
+    async def close(self):
+        self.task.cancel()
+        self.server.close()
+        for player in self.players:
+            player.writer.close()
+        await self.server.wait_closed()
+
+    async def handle(self, reader, writer):
+        '''Receives actions of one player until disconnection'''
+        if len(self.players) >= 2:
+            writer.write(encode({"error": "server is full"}))
+            writer.close()
+            return
+        player = Player(reader, writer)
+        self.players.append(player)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    message = json.loads(line)
+                    seq = int(message["seq"])
+                    action = message["a"]
+                except (ValueError, KeyError, TypeError):
+                    break
+                if not isinstance(action, str):
+                    # step() looks actions up in ACTIONS, anything else
+                    # is a protocol violation
+                    break
+                player.inputs.append((seq, action))
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self.players.remove(player)
+            writer.close()
+            if self.round and self.players:
+                self.end_round(self.players[0])
+
+    def new_round(self):
+        '''Starts games of both players with the same pieces'''
+        self.round += 1
+        seed = self.random.getrandbits(32)
+        for number, player in enumerate(self.players):
+            player.model = self.model_class(size=self.size, seed=seed,
+                                            clock=self.clock)
+            player.inputs = []
+            player.garbage = 0
+            player.sent = (None, None)
+            player.writer.write(encode({"round": self.round,
+                                        "player": number,
+                                        "size": list(self.size)}))
+
+    def end_round(self, winner):
+        '''Sends result of the round, next round starts on the next tick'''
+        number = self.players.index(winner) if winner in self.players \
+            else None
+        if number is not None:
+            self.wins[number] += 1
+        for player in self.players:
+            player.writer.write(encode({"over": self.round,
+                                        "winner": number}))
+            player.model = None
+
+    def step_player(self, player, opponent):
+        '''Applies garbage and actions to player's game and makes its due
+        turns, returns False if the player has lost'''
+        model = player.model
+        if player.garbage:
+            garbage = player.garbage
+            player.garbage = 0
+            if not model.add_garbage(garbage,
+                                     self.random.randrange(self.size[0])):
+                return False
+        for seq, action in player.inputs:
+            if action in ACTIONS:
+                model.apply_action(action)
+            player.ack = seq
+        player.inputs = []
+        for turn in range(model.ticks_due()):
+            lines = model.lines
+            if not model.tick():
+                return False
+            opponent.garbage += ATTACK[min(model.lines - lines,
+                                           len(ATTACK) - 1)]
+        return True
+
+    def step(self):
+        '''Makes one server tick and sends its results'''
+        self.tick += 1
+        if len(self.players) < 2:
+            return
+        if self.players[0].model is None:
+            self.new_round()
+        first, second = self.players[:2]
+        for player, opponent in ((first, second), (second, first)):
+            if not self.step_player(player, opponent):
+                self.end_round(opponent)
+                return
+        states = (board_state(first.model), board_state(second.model))
+        for player, own, other in ((first, states[0], states[1]),
+                                   (second, states[1], states[0])):
+            message = {"t": self.tick, "ack": player.ack}
+            delta = state_delta(player.sent[0], own)
+            if delta:
+                message["you"] = delta
+            delta = state_delta(player.sent[1], other)
+            if delta:
+                message["opp"] = delta
+            player.sent = (own, other)
+            if len(message) > 2 or player.ack != player.sent_ack:
+                player.sent_ack = player.ack
+                player.writer.write(encode(message))
+
+    async def run(self):
+        '''Makes server ticks at self.tick_rate'''
+        scheduler = FixedTimestep(1.0 / self.tick_rate, self.clock)
+        while True:
+            for tick in range(scheduler.advance()):
+                self.step()
+            for player in self.players:
+                await player.writer.drain()
+            await asyncio.sleep(scheduler.step - scheduler.accumulator)
+
+
+class VersusClient:
+    '''Client of VersusServer predicting its own piece
+    self.state, self.opponent_state: board state dicts from server
+    self.model: BitboardTetrisModel of own game, actions are applied to it
+        before server confirms them
+    self.opponent: BitboardTetrisModel of opponent's game
+    self.pending: list of (seq, action) not acknowledged by server
+    self.grids: (own, opponent's) Grid to draw models on or None
+    '''
+
+    def __init__(self, grids=(None, None)):
+        self.grids = grids
+        self.model = None
+        self.opponent = None
+        self.state = None
+        self.opponent_state = None
+        self.pending = []
+        self.seq = 0
+        self.player = None
+        self.results = []
+        self.reader = None
+        self.writer = None
+
+    async def connect(self, host, port):
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+    def send_action(self, action):
+        '''Applies action to own model and sends it to server,
+        writes are flushed by the event loop'''
+        if self.model is None or self.model.status != "game_active":
+            return
+        self.seq += 1
+        self.pending.append((self.seq, action))
+        self.model.apply_action(action)
+        self.writer.write(encode({"seq": self.seq, "a": action}))
+
+    def _new_model(self, size, grid):
+        return BitboardTetrisModel(grid, size=size, seed=0,
+                                   clock=VirtualClock())
+
+    def handle(self, message):
+        '''Updates client by server message'''
+        if "round" in message:
+            size = tuple(message["size"])
+            self.player = message["player"]
+            self.model = self._new_model(size, self.grids[0])
+            self.opponent = self._new_model(size, self.grids[1])
+            self.opponent.show_ghost = False
+            self.state = self.opponent_state = None
+            self.pending = []
+        elif "over" in message:
+            self.results.append(message["winner"] == self.player)
+            if self.model is not None:
+                self.model.status = "game_over"
+        elif "t" in message and self.model is not None:
+            height = self.model.grid_size[1]
+            if "you" in message:
+                self.state = apply_delta(self.state, message["you"], height)
+            if "opp" in message:
+                self.opponent_state = apply_delta(self.opponent_state,
+                                                  message["opp"], height)
+                load_state(self.opponent, self.opponent_state)
+            self.pending = [(seq, action) for seq, action in self.pending
+                            if seq > message["ack"]]
+            # reconcile prediction: server state and unconfirmed actions
+            if self.state is not None:
+                load_state(self.model, self.state)
+                for seq, action in self.pending:
+                    self.model.apply_action(action)
+
+    async def receive(self):
+        '''Handles server messages until disconnection'''
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                return
+            self.handle(json.loads(line))
+
+
+class BotClient(VersusClient):
+    '''VersusClient playing with tetris_ai.AutoPlayer
+    self.think_delay: delay between actions in seconds'''
+    think_delay = 0.05
+
+    def __init__(self, grids=(None, None), planner=None):
+        VersusClient.__init__(self, grids)
+        self.autoplayer = tetris_ai.AutoPlayer(planner)
+
+    async def play(self):
+        '''Sends actions until disconnection'''
+        receiving = asyncio.ensure_future(self.receive())
+        try:
+            while not receiving.done():
+                if self.model is not None and \
+                        self.model.status == "game_active":
+                    self.send_action(self.autoplayer.next_action(self.model))
+                    await self.writer.drain()
+                await asyncio.sleep(self.think_delay)
+        finally:
+            receiving.cancel()
+
+
+async def run_local_match(duration, seed=None, bots=2):
+    '''Plays `bots` bot clients against each other on localhost server for
+    `duration` seconds, returns (server, clients)'''
+    server = VersusServer(seed=seed)
+    await server.start()
+    clients = [BotClient() for i in range(bots)]
+    for client in clients:
+        await client.connect("127.0.0.1", server.port)
+    tasks = [asyncio.ensure_future(client.play()) for client in clients]
+    await asyncio.sleep(duration)
+    for client in clients:
+        client.close()
+    for task in tasks:
+        task.cancel()
+    await server.close()
+    return server, clients
+
+
+async def serve(host, port):
+    '''Runs server until cancelled'''
+    server = VersusServer(host, port)
+    await server.start()
+    print("Serving on {}:{}".format(host, server.port))
+    await server.task
+
+
+async def run_bot(host, port):
+    '''Plays bot client until server disconnects'''
+    client = BotClient()
+    await client.connect(host, port)
+    await client.play()